@@ -0,0 +1,232 @@
+"""
+Offline load test of batch classification against the stub LM.
+
+Runs label_all_activities_async over synthetic activities with StubLM
+configured as the DSPy LM, so the scheduler, retries and checkpointing can be
+exercised at scale without an API key. Reports activities/sec, LM calls,
+injected faults, retries and whether every activity was eventually
+classified, then re-runs against the same checkpoint to confirm a resumed run
+makes no further calls. Results are written as JSON under benchmarks/results.
+
+    python benchmarks/bench_batch_classify.py --sizes 1000 10000 100000 --rate-limit-rate 0.02
+"""
+
+import argparse
+import asyncio
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import dspy
+import numpy as np
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from definitions import NARRATIVE_FIELDS, ROOT_DIR
+from lib.dspy_batch_classify import ClassificationOptions, label_all_activities_async
+from lib.dspy_checkpoint import CheckpointStore
+from lib.dspy_classifier import IATIClassifier
+from lib.dspy_retry import RetryPolicy
+from lib.dspy_stub_lm import LOCATIONS, ORGANISATIONS, StubLM
+from lib.util_file import read_json, write_json
+
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_RUN_OPTIONS = {
+    "concurrency": 10,
+    "max_concurrency": 64,
+    "retry_base_delay": 1.0,
+    "batch_size": 500,
+}
+
+WORDS = [
+    "refugee",
+    "water",
+    "education",
+    "health",
+    "livelihoods",
+    "protection",
+    "infrastructure",
+    "capacity",
+    "school",
+    "support",
+    "community",
+    "governance",
+]
+
+
+def generate_activities(n: int, duplicate_share: float = 0.1, seed: int = 0):
+    """Synthetic activities with a title, description and org narratives."""
+    rng = np.random.default_rng(seed)
+    activities = []
+    for i in range(n):
+        if activities and rng.random() < duplicate_share:
+            activity = dict(activities[rng.integers(len(activities))])
+        else:
+            activity = {field: "" for field in NARRATIVE_FIELDS}
+            activity["title_narrative"] = " ".join(rng.choice(WORDS, 4)).capitalize()
+            activity["description_narrative"] = " ".join(
+                rng.choice(WORDS, rng.integers(0, 60))
+            )
+            activity["location_name_narrative"] = str(rng.choice(LOCATIONS))
+            activity["reporting_org_narrative"] = str(rng.choice(ORGANISATIONS))
+        activity["unique_id"] = f"bench-{i}"
+        activities.append(activity)
+    return activities
+
+
+def benchmark_size(n: int, stub_options: dict, run_options: dict) -> dict:
+    """Classify n synthetic activities, then resume the same run."""
+    activities = generate_activities(n)
+    model = dspy.ChainOfThought(IATIClassifier)
+    options = ClassificationOptions(
+        concurrency=run_options["concurrency"],
+        max_concurrency=run_options["max_concurrency"],
+        retry_policy=RetryPolicy(base_delay=run_options["retry_base_delay"]),
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        lm = StubLM(**stub_options)
+        store = CheckpointStore("bench", Path(tmp) / "progress.sqlite")
+        with dspy.context(lm=lm):
+            start = time.perf_counter()
+            asyncio.run(
+                label_all_activities_async(
+                    model,
+                    activities,
+                    output_dir=tmp,
+                    batch_size=run_options["batch_size"],
+                    checkpoint_store=store,
+                    options=options,
+                )
+            )
+            seconds = time.perf_counter() - start
+            summary = read_json(os.path.join(tmp, "run_summary.json"))
+            classified = len(store)
+
+            # Resuming against the same checkpoint must not call the LM again
+            calls_before = lm.stats["calls"]
+            asyncio.run(
+                label_all_activities_async(
+                    model,
+                    activities,
+                    output_dir=tmp,
+                    batch_size=run_options["batch_size"],
+                    checkpoint_store=store,
+                    options=options,
+                )
+            )
+            resume_calls = lm.stats["calls"] - calls_before
+        store.close()
+
+    result = {
+        "activities": n,
+        "seconds": seconds,
+        "activities_per_second": n / seconds if seconds else None,
+        "classified": classified,
+        "unclassified": n - classified,
+        "lm_calls": calls_before,
+        "injected": {k: v for k, v in lm.stats.items() if k != "calls"},
+        "retries": summary["retries"],
+        "retries_by_class": summary["retries_by_class"],
+        "failures_by_class": summary["failures_by_class"],
+        "errors": summary["errors"],
+        "latency_seconds": {
+            kind: {q: stats[q] for q in ("p50", "p90", "p99")}
+            for kind, stats in summary["latency_seconds"].items()
+        },
+        "resume_calls": resume_calls,
+    }
+    print(
+        f"{n:>9,} activities: {seconds:8.1f}s "
+        f"({result['activities_per_second']:.1f}/s), {calls_before} LM calls, "
+        f"{result['unclassified']} unclassified, {resume_calls} calls on resume"
+    )
+    return result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, text=True
+        ).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def run_benchmarks(
+    sizes=None, stub_options=None, run_options=None, output_path: str = None
+) -> str:
+    sizes = sizes or DEFAULT_SIZES
+    stub_options = stub_options or {}
+    run_options = {**DEFAULT_RUN_OPTIONS, **(run_options or {})}
+    results = {
+        "benchmark": "batch_classify",
+        "run_at": datetime.now().isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "dspy": dspy.__version__,
+        "platform": platform.platform(),
+        "stub": stub_options,
+        "run": run_options,
+        "results": [benchmark_size(n, stub_options, run_options) for n in sizes],
+    }
+
+    if not output_path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = os.path.join(RESULTS_DIR, f"batch_classify_{timestamp}.json")
+
+    write_json(results, output_path)
+    print(f"Results saved to: {output_path}")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--latency-median", type=float, default=0.05)
+    parser.add_argument("--latency-sigma", type=float, default=0.4)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--capacity", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--concurrency", type=int, default=DEFAULT_RUN_OPTIONS["concurrency"]
+    )
+    parser.add_argument(
+        "--max-concurrency", type=int, default=DEFAULT_RUN_OPTIONS["max_concurrency"]
+    )
+    parser.add_argument(
+        "--retry-base-delay",
+        type=float,
+        default=DEFAULT_RUN_OPTIONS["retry_base_delay"],
+    )
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    stub_options = {
+        "latency_median": args.latency_median,
+        "latency_sigma": args.latency_sigma,
+        "rate_limit_rate": args.rate_limit_rate,
+        "error_rate": args.error_rate,
+        "malformed_rate": args.malformed_rate,
+        "capacity": args.capacity,
+        "seed": args.seed,
+    }
+    run_options = {
+        "concurrency": args.concurrency,
+        "max_concurrency": args.max_concurrency,
+        "retry_base_delay": args.retry_base_delay,
+    }
+    run_benchmarks(args.sizes, stub_options, run_options, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Scaling benchmark for the util_xr USD conversion path.
+
+Generates synthetic transaction frames with the currency mix of
+transactions_cleaned.csv, then times and memory-profiles each stage of
+convert_all_to_usd. Results are written as JSON under benchmarks/results so
+runs from different versions can be compared with compare_results().
+
+    python benchmarks/bench_util_xr.py --sizes 1000 100000 1000000
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from definitions import ROOT_DIR
+from lib.util_file import read_json, write_json
+from lib.util_xr import (
+    apply_currency_conversions,
+    create_special_currency_rates,
+    find_exchange_rates_for_currency,
+    load_standardized_exchange_rates,
+    prepare_transaction_dates,
+)
+
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+# Share of transactions per currency in transactions_cleaned.csv
+CURRENCY_MIX = {
+    "USD": 0.513,
+    "GBP": 0.155,
+    "EUR": 0.119,
+    "SEK": 0.092,
+    "CAD": 0.047,
+    "CHF": 0.034,
+    "DKK": 0.018,
+    "NOK": 0.011,
+    "JOD": 0.007,
+    "AUD": 0.004,
+    "KRW": 0.001,
+    "CZK": 0.0005,
+    "JPY": 0.0003,
+    "SAR": 0.0002,
+}
+MISSING_DATE_SHARE = 0.01
+
+
+def generate_transactions(n: int, seed: int = 0) -> pd.DataFrame:
+    """Synthetic transactions shaped like transactions_cleaned.csv."""
+    rng = np.random.default_rng(seed)
+    currencies = np.array(list(CURRENCY_MIX))
+    weights = np.array(list(CURRENCY_MIX.values()))
+
+    start = np.datetime64("2010-01-01", "s").astype(np.int64)
+    end = np.datetime64("2025-06-01", "s").astype(np.int64)
+    days = rng.integers(0, (end - start) // 86400, size=n)
+    dates = np.datetime_as_string(
+        (start + days * 86400).astype("datetime64[s]"), unit="s"
+    ).astype(object)
+    dates = dates + "Z"
+    dates[rng.random(n) < MISSING_DATE_SHARE] = None
+
+    return pd.DataFrame(
+        {
+            "iati_identifier": rng.integers(0, n // 5 + 1, size=n).astype(str),
+            "transaction_value": rng.lognormal(11, 2, size=n).round(2),
+            "currency": rng.choice(currencies, size=n, p=weights / weights.sum()),
+            "transaction_value_value_date": dates,
+        }
+    )
+
+
+def _measure(fn, *args, **kwargs):
+    """Run fn once for wall time and once under tracemalloc for peak memory."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    fn(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, {"seconds": seconds, "peak_mb": peak / 1024**2}
+
+
+def benchmark_size(n: int, policies=None) -> dict:
+    """Time and memory-profile each conversion stage for one frame size."""
+    tf = generate_transactions(n)
+    standardized_xr, load_stats = _measure(load_standardized_exchange_rates)
+    special_rates = create_special_currency_rates()
+
+    tf_prepared, prepare_stats = _measure(prepare_transaction_dates, tf)
+    tf_with_rates, find_stats = _measure(
+        find_exchange_rates_for_currency,
+        tf_prepared,
+        standardized_xr,
+        special_rates,
+        policies=policies,
+    )
+    _, apply_stats = _measure(apply_currency_conversions, tf_with_rates)
+
+    stages = {
+        "load_standardized_exchange_rates": load_stats,
+        "prepare_transaction_dates": prepare_stats,
+        "find_exchange_rates_for_currency": find_stats,
+        "apply_currency_conversions": apply_stats,
+    }
+    total = sum(stage["seconds"] for stage in stages.values())
+    print(f"{n:>11,} rows: {total:8.3f}s")
+    for name, stats in stages.items():
+        print(f"    {name:<34} {stats['seconds']:8.3f}s {stats['peak_mb']:10.1f} MB")
+
+    return {"rows": n, "total_seconds": total, "stages": stages}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, text=True
+        ).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def run_benchmarks(sizes=None, policies=None, output_path: str = None) -> str:
+    """Benchmark every size and write the machine-readable results file."""
+    sizes = sizes or DEFAULT_SIZES
+    results = {
+        "benchmark": "util_xr",
+        "run_at": datetime.now().isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "policies": policies or [],
+        "results": [benchmark_size(n, policies) for n in sizes],
+    }
+
+    if not output_path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = os.path.join(RESULTS_DIR, f"util_xr_{timestamp}.json")
+
+    write_json(results, output_path)
+    print(f"Results saved to: {output_path}")
+    return output_path
+
+
+def compare_results(baseline_path: str, candidate_path: str, threshold: float = 1.2):
+    """Print per-stage slowdowns above `threshold` between two result files."""
+    baseline = {r["rows"]: r for r in read_json(baseline_path)["results"]}
+    candidate = {r["rows"]: r for r in read_json(candidate_path)["results"]}
+
+    regressions = []
+    for rows in sorted(baseline.keys() & candidate.keys()):
+        for stage, stats in candidate[rows]["stages"].items():
+            before = baseline[rows]["stages"].get(stage)
+            if not before or before["seconds"] == 0:
+                continue
+            ratio = stats["seconds"] / before["seconds"]
+            if ratio > threshold:
+                regressions.append(
+                    {"rows": rows, "stage": stage, "slowdown": round(ratio, 2)}
+                )
+
+    print(json.dumps(regressions, indent=2) if regressions else "No regressions")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--policies", nargs="*", default=None)
+    parser.add_argument("--output", default=None)
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), default=None
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+    else:
+        run_benchmarks(args.sizes, args.policies, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,10 @@ from pathlib import Path
 import dspy
 
 from definitions import DSPY_CONFIG, GEMINI_API_KEY, NARRATIVE_FIELDS, ROOT_DIR
-from lib.dspy_batch_classify import label_all_activities_async
+from lib.dspy_batch_classify import ClassificationOptions, label_all_activities_async
 from lib.dspy_classifier import generate_labels, smart_sample
 from lib.dspy_optimizer import prepare_examples, train_model
+from lib.dspy_prediction_cache import PredictionCache, program_fingerprint
 from lib.util_file import read_json, write_json
 from lib.util_mlfow import MLflowServerManager, setup_mlflow_tracking
 
@@ -28,11 +29,22 @@ def setup_dspy_config():
 def build_sample_for_labeling():
     """Generate initial sample for human labeling."""
     print("Building sample for labeling...")
-    activities_data = read_json("./data/iati/jordan_activities_narratives.json")
-    sampled = smart_sample(activities_data, DSPY_CONFIG["sample_size"])
-    print(f"Sampled {len(sampled)} activities")
-
-    initial_labels = generate_labels(sampled, DSPY_CONFIG["strong_model"])
+    sample_path = "./data/training_pre_human_sample.json"
+    # Reuse an earlier sample so an interrupted labeling run can resume
+    if os.path.exists(sample_path):
+        sampled = read_json(sample_path)
+        print(f"Resuming with {len(sampled)} previously sampled activities")
+    else:
+        activities_data = read_json("./data/iati/jordan_activities_narratives.json")
+        sampled = smart_sample(activities_data, DSPY_CONFIG["sample_size"])
+        write_json(sampled, sample_path)
+        print(f"Sampled {len(sampled)} activities")
+
+    initial_labels = generate_labels(
+        sampled,
+        DSPY_CONFIG["strong_model"],
+        progress_path="./data/training_pre_human.jsonl",
+    )
     write_json(initial_labels, "./data/training_pre_human.json")
     print("Sample saved to ./data/training_pre_human.json")
 
@@ -79,9 +91,24 @@ def load_saved_model(model_path: str):
 
 
 async def batch_classify(
-    model_path, activities, num_activities: int = None, batch_size: int = 50
+    model_path,
+    activities,
+    num_activities: int = None,
+    batch_size: int = 50,
+    use_cache: bool = True,
+    compaction: dict = None,
+    pack_size: int = 1,
+    prefilter: bool = False,
+    cascade: bool = False,
+    priorities: dict = None,
+    budget=None,
 ):
-    """Run batch classification with timestamp-based output folder."""
+    """
+    Run batch classification with timestamp-based output folder.
+
+    Pass `priorities` and `budget` (see lib.dspy_priority) to classify the
+    highest-weighted activities first and stop at a cost, call or time cap.
+    """
 
     # Create timestamped output directory
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -92,6 +119,16 @@ async def batch_classify(
     model = load_saved_model(model_path)
     print(f"Loaded model from: {model_path}")
 
+    # Escalate failed task-model answers to the strong model
+    strong_lm = (
+        dspy.LM(DSPY_CONFIG["strong_model"], api_key=GEMINI_API_KEY, max_tokens=4000)
+        if cascade
+        else None
+    )
+
+    # Predictions are shared across runs and output folders for the same program
+    cache = PredictionCache(program_fingerprint(model)) if use_cache else None
+
     # Prepare input data
     if not activities:
         activities_path = os.path.join(
@@ -114,8 +151,43 @@ async def batch_classify(
         input_path=str(subset_path),
         output_dir=str(output_dir),
         batch_size=batch_size,
+        cache=cache,
+        options=ClassificationOptions(
+            compaction=compaction,
+            pack_size=pack_size,
+            prefilter=prefilter,
+            strong_lm=strong_lm,
+            priorities=priorities,
+            budget=budget,
+        ),
     )
+    if cache is not None:
+        cache.close()
+
+    print(f"Results saved to: {output_dir}")
 
+
+async def reclassify_fields(
+    model_path, results_dir, groups=None, use_cache: bool = True
+):
+    """
+    Re-run changed field groups of an earlier run into a new timestamped folder.
+
+    `model_path` is the saved program that produced the run, whose
+    instructions and demos the re-run groups keep. See lib.dspy_field_groups;
+    pass `groups` for runs without field_versions.json.
+    """
+    from lib.dspy_field_groups import reclassify_changed_fields
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_dir = Path(ROOT_DIR) / "data" / "iati" / "batch-classify" / timestamp
+    await reclassify_changed_fields(
+        os.path.join(results_dir, "classified_results.json"),
+        str(output_dir),
+        groups=groups,
+        use_cache=use_cache,
+        program=load_saved_model(model_path),
+    )
     print(f"Results saved to: {output_dir}")
 
 
@@ -0,0 +1,122 @@
+"""
+Sharded batch classification across processes or machines.
+
+Every shard writes under the same --output-dir, so on several machines point
+it at shared storage (or copy the shards/ folders together before merging).
+
+    # one shard per machine
+    python iati/dspy_run_sharded.py run --model best_model.json --shard 0 --num-shards 4 --output-dir data/iati/batch-classify/sharded
+    # all shards as local processes
+    python iati/dspy_run_sharded.py run --model best_model.json --num-shards 4 --processes 4 --output-dir data/iati/batch-classify/sharded
+    # once every shard has finished
+    python iati/dspy_run_sharded.py merge --num-shards 4 --output-dir data/iati/batch-classify/sharded
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from definitions import ROOT_DIR
+from iati.dspy_run import load_saved_model, setup_dspy_config
+from lib.dspy_sharding import classify_shard, merge_shards
+from lib.util_file import read_json
+
+DEFAULT_ACTIVITIES_PATH = os.path.join(
+    ROOT_DIR, "data", "iati", "hashed_activities_narratives.json"
+)
+
+
+def run_shard(
+    model_path: str,
+    activities_path: str,
+    output_dir: str,
+    shard: int,
+    num_shards: int,
+    batch_size: int = 50,
+) -> str:
+    """Configure DSPy, load the model and classify one shard in this process."""
+    setup_dspy_config()
+    model = load_saved_model(model_path)
+    activities = read_json(activities_path)
+    shard_dir = asyncio.run(
+        classify_shard(
+            model,
+            activities,
+            output_dir,
+            shard,
+            num_shards,
+            batch_size=batch_size,
+        )
+    )
+    return str(shard_dir)
+
+
+def run_shards_locally(
+    model_path: str,
+    activities_path: str,
+    output_dir: str,
+    num_shards: int,
+    processes: int,
+    batch_size: int = 50,
+) -> None:
+    """Run every shard in a pool of `processes` worker processes, then merge."""
+    # Spawn rather than fork so no event loop or SQLite handle is inherited
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        futures = [
+            pool.submit(
+                run_shard,
+                model_path,
+                activities_path,
+                output_dir,
+                shard,
+                num_shards,
+                batch_size,
+            )
+            for shard in range(num_shards)
+        ]
+        for future in futures:
+            print(f"Finished {future.result()}")
+    merge_shards(output_dir, num_shards)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("command", choices=["run", "merge"])
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--num-shards", type=int, required=True)
+    parser.add_argument("--shard", type=int, default=None)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--activities", default=DEFAULT_ACTIVITIES_PATH)
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        merge_shards(args.output_dir, args.num_shards)
+    elif not args.model:
+        parser.error("run requires --model")
+    elif args.shard is not None:
+        run_shard(
+            args.model,
+            args.activities,
+            args.output_dir,
+            args.shard,
+            args.num_shards,
+            args.batch_size,
+        )
+    else:
+        run_shards_locally(
+            args.model,
+            args.activities,
+            args.output_dir,
+            args.num_shards,
+            args.processes,
+            args.batch_size,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import csv
 import random
 
@@ -7,37 +8,32 @@ import pandas as pd
 
 from definitions import ROOT_DIR
 from definitions import TRANSACTION_FIELDS
-from lib.util_file import read_json
+from lib.util_file import read_json, read_json_records
 from lib.util_pandas import show_text_wrapped
 from lib.util_xr import *
+from lib.util_xr_memo import convert_all_to_usd_incremental
 from lib.iati_datastore_utils import query_collection, make_api_request
 from typing import List, Set, Tuple, Dict, Any, Optional
 
 from lib.util_xr import spot_check_xr_matching
 
 
-def load_data():
-    data_path = os.path.join(
-        ROOT_DIR,
-        "data",
-        "iati",
-        "batch-classify",
-        "20250604_090728",
-        "classified_results.json",
-    )
-    data = read_json(data_path)
+def load_data(run_dir: str = None):
+    if not run_dir:
+        run_dir = os.path.join(
+            ROOT_DIR, "data", "iati", "batch-classify", "20250604_090728"
+        )
+    data = read_json_records(os.path.join(run_dir, "classified_results.json"))
     return pd.DataFrame.from_dict(data)
 
 
+def is_syria_ref_group(ref_group: List[str]) -> bool:
+    return "Syria" in ref_group or "mixed_or_unspecified_refugees" in ref_group
+
+
 def filter_syria_ref_activities(df: pd.DataFrame) -> pd.DataFrame:
     # Filter only those activities potentially targeting Syrian Refugees
-    return df[
-        df["llm_ref_group"].map(
-            lambda x: True
-            if "Syria" in x or "mixed_or_unspecified_refugees" in x
-            else False
-        )
-    ]
+    return df[df["llm_ref_group"].map(is_syria_ref_group)]
 
 
 def spot_check_narrative(df: pd.DataFrame, narratives: List = None):
@@ -115,6 +111,27 @@ def build_transaction_rows_from_all_activities_json(iati_ids: Set) -> pd.DataFra
     return df
 
 
+def fetch_transaction_rows(batch_ids: List[str]) -> List[List[str]]:
+    """Transaction CSV rows (header first) for a batch of ids from the IATI Datastore API"""
+    # Build query
+    quoted_ids = ['"' + id + '"' for id in batch_ids]
+    or_clause = " OR ".join(quoted_ids)
+    query_string = "iati_identifier:(" + or_clause + ")"
+
+    query_params = {
+        "q": query_string,
+        "fl": ",".join(["iati_identifier", "default_currency"] + TRANSACTION_FIELDS),
+        "wt": "csv",
+        "rows": 10000,  # Large number to get all results in batch
+    }
+
+    response = make_api_request("GET", "/transaction/select", params=query_params)
+
+    # Parse CSV response
+    csv_reader = csv.reader(response.text.split("\n"), delimiter=",", escapechar="\\")
+    return list(csv_reader)
+
+
 def build_transaction_csv_from_datastore(iati_ids: Set, batch_size: int = 100) -> str:
     """Build a CSV file of transactions from the IATI Datastore API"""
 
@@ -131,32 +148,8 @@ def build_transaction_csv_from_datastore(iati_ids: Set, batch_size: int = 100) -
             batch_ids = iati_ids_list[i : i + batch_size]
             print(f"Processing batch {i//batch_size + 1}: {len(batch_ids)} IDs")
 
-            # Build query
-            quoted_ids = ['"' + id + '"' for id in batch_ids]
-            or_clause = " OR ".join(quoted_ids)
-            query_string = "iati_identifier:(" + or_clause + ")"
-
-            query_params = {
-                "q": query_string,
-                "fl": ",".join(
-                    ["iati_identifier", "default_currency"] + TRANSACTION_FIELDS
-                ),
-                "wt": "csv",
-                "rows": 10000,  # Large number to get all results in batch
-            }
-
             try:
-                response = make_api_request(
-                    "GET", "/transaction/select", params=query_params
-                )
-                csv_text = response.text
-
-                # Parse CSV response
-                # csv_reader = csv.reader(StringIO(csv_text))
-                csv_reader = csv.reader(
-                    response.text.split("\n"), delimiter=",", escapechar="\\"
-                )
-                rows = list(csv_reader)
+                rows = fetch_transaction_rows(batch_ids)
 
                 if not rows:
                     continue
@@ -179,6 +172,77 @@ def build_transaction_csv_from_datastore(iati_ids: Set, batch_size: int = 100) -
     return output_path
 
 
+async def stream_transactions_for_classified(
+    results, output_path: str = None, batch_size: int = 100
+) -> Set[str]:
+    """
+    Fetch transactions for Syrian-refugee activities while classification runs.
+
+    `results` is an async iterator of classified activities, e.g.
+
+        results = stream_classified_activities(model, activities, output_dir=...)
+        iati_ids = asyncio.run(stream_transactions_for_classified(results))
+
+    Relevant ids are fetched from the datastore in batches of `batch_size` in a
+    worker thread, so the event loop keeps classifying in the meantime.
+
+    Transactions already in `output_path` are kept and their ids not fetched
+    again, so results replayed by a resumed stream only fetch what earlier
+    runs missed; remove the file to start over. Returns the relevant
+    iati_identifiers with transactions fetched, including those already in the
+    file; ids whose batch failed are left out.
+    """
+    if not output_path:
+        output_path = os.path.join(ROOT_DIR, "data", "iati", "transactions.csv")
+
+    iati_ids = set()
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        existing = pd.read_csv(output_path, usecols=["iati_identifier"])
+        iati_ids.update(existing["iati_identifier"].dropna())
+        print(f"Keeping transactions for {len(iati_ids)} activities already fetched")
+    pending = []
+    batches = 0
+
+    with open(output_path, "a", newline="", encoding="utf-8") as outfile:
+        writer = csv.writer(outfile)
+        header_written = outfile.tell() > 0
+
+        async def fetch(batch_ids):
+            nonlocal batches, header_written
+            batches += 1
+            print(f"Fetching batch {batches}: {len(batch_ids)} IDs")
+            try:
+                rows = await asyncio.to_thread(fetch_transaction_rows, batch_ids)
+            except Exception as e:
+                # Left out so a later run, which replays them, fetches again
+                print(f"Error processing batch {batches}: {e}")
+                iati_ids.difference_update(batch_ids)
+                return
+            if not rows:
+                return
+            if not header_written:
+                writer.writerow(rows[0])
+                header_written = True
+            writer.writerows(rows[1:])
+
+        async for activity in results:
+            iati_id = activity.get("iati_identifier")
+            if iati_id in iati_ids or not is_syria_ref_group(
+                activity.get("llm_ref_group") or []
+            ):
+                continue
+            iati_ids.add(iati_id)
+            pending.append(iati_id)
+            if len(pending) >= batch_size:
+                await fetch(pending)
+                pending = []
+        if pending:
+            await fetch(pending)
+
+    print(f"Transaction CSV written to: {output_path}")
+    return iati_ids
+
+
 def clean_iati_transaction_data(output_filename: str, iati_ids: Set) -> pd.DataFrame:
     tf = pd.read_csv(os.path.join(ROOT_DIR, "data", "iati", "transactions.csv"))
     tf = tf[
@@ -192,7 +256,13 @@ def clean_iati_transaction_data(output_filename: str, iati_ids: Set) -> pd.DataF
     return tf
 
 
-def main():
+def main(incremental_xr: bool = False):
+    """
+    Build the activity and USD transaction tables.
+
+    With `incremental_xr`, exchange rates memoized by earlier runs are reused
+    and only new currency-date pairs are looked up.
+    """
     df = load_data()
     df = filter_syria_ref_activities(df)
     df = filter_duplicates(df)
@@ -208,7 +278,10 @@ def main():
 
     tf = clean_iati_transaction_data("transactions_cleaned.csv", iati_ids)
 
-    tf = convert_all_to_usd(tf)
+    if incremental_xr:
+        tf = convert_all_to_usd_incremental(tf)
+    else:
+        tf = convert_all_to_usd(tf)
     print("done")
 
     sample = tf[tf["currency"] != "USD"][["currency", "date", "exchange_rate"]].sample(
@@ -1,9 +1,120 @@
 import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
 
+import dspy
+
 from definitions import NARRATIVE_FIELDS, ROOT_DIR
-from lib.util_file import read_json, write_json
+from lib.dspy_cascade import ModelCascade, agreement, validation_failure
+from lib.dspy_checkpoint import CheckpointStore
+from lib.dspy_classifier import LLM_FIELDS
+from lib.dspy_concurrency import AdaptiveConcurrencyController
+from lib.dspy_packed_classify import PackedClassifier, is_packable, pack_activities
+from lib.dspy_prediction_cache import (
+    PredictionCache,
+    narrative_hash,
+    program_fingerprint,
+)
+from lib.dspy_prefilter import (
+    apply_light_defaults,
+    make_light_classifier,
+    prefilter_activity,
+)
+from lib.dspy_priority import BudgetExhausted, weight_coverage
+from lib.dspy_prompt_compaction import (
+    CompactionReport,
+    compact_narratives,
+    silence_missing_inputs_warning,
+)
+from lib.dspy_retry import (
+    PARSE_FAILURE,
+    ClassificationError,
+    RetryPolicy,
+    classify_error,
+)
+from lib.dspy_telemetry import RunTelemetry, TelemetryCallback
+from lib.util_file import (
+    append_jsonl,
+    read_json,
+    read_json_records,
+    read_jsonl,
+    write_json,
+    write_json_atomic,
+)
+
+DEFAULT_OUTPUT_DIR = str(Path(ROOT_DIR) / "data" / "iati")
+
+# Set by the classifier on every result, with the label fields it predicts,
+# replacing values from earlier runs
+RESULT_META_FIELDS = {"classified_at", "classified_by", "prefilter_route"}
+
+
+class ClassificationOptions:
+    """
+    How label_all_activities_async schedules and classifies activities.
+
+    Args:
+        concurrency: In-flight calls to start with, adapted up to
+            `max_concurrency` based on latency, errors and rate limits
+        max_concurrency: Upper bound on in-flight calls; also sizes the thread
+            pool used only for programs without an async interface
+        compaction: Keyword arguments for compact_narratives (or {} for the
+            defaults) to send compacted narratives instead of all raw fields
+        pack_size: With > 1, activities whose narratives fit in
+            `pack_max_chars` are classified `pack_size` at a time in one
+            packed call built from the model's instructions and demos; any
+            without valid packed labels fall back to a single call. Packed
+            labels go through the cascade like single ones, and activities
+            the prefilter routes to the light program are not packed
+        prefilter: Classify activities matching none of the refugee keyword
+            patterns in lib.dspy_prefilter with a lighter single-step
+            signature; results record the route taken
+        dedupe: Classify identical narratives once, copying the labels to
+            every member and recording `narrative_hash` and `classified_from`
+        strong_lm: Cascade to this LM: answers failing lib.dspy_cascade
+            checks, or agreeing less than `consistency_threshold` with a
+            sampled second answer, are re-classified by it; results record
+            `classified_by` ("task" or "strong"). Cascaded answers are cached
+            apart from those of runs without it
+        retry_policy: RetryPolicy (lib.dspy_retry) for failed calls, retried
+            per activity with backoff and a budget per error class
+        priorities: {unique_id: weight}, e.g. from lib.dspy_priority, to
+            classify the heaviest activities first
+        budget: RunBudget after which no new calls start; work not started is
+            left unclassified (not errored) for the next run
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 10,
+        max_concurrency: int = 64,
+        compaction: dict = None,
+        pack_size: int = 1,
+        pack_max_chars: int = 600,
+        prefilter: bool = False,
+        dedupe: bool = True,
+        strong_lm=None,
+        consistency_threshold: float = None,
+        retry_policy=None,
+        priorities: dict = None,
+        budget=None,
+    ):
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.compaction = compaction
+        self.pack_size = pack_size
+        self.pack_max_chars = pack_max_chars
+        self.prefilter = prefilter
+        self.dedupe = dedupe
+        self.strong_lm = strong_lm
+        self.consistency_threshold = consistency_threshold
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.priorities = priorities
+        self.budget = budget
 
 
 async def label_all_activities_async(
@@ -12,104 +123,129 @@ async def label_all_activities_async(
     input_path: str = None,
     output_dir: str = None,
     batch_size: int = 50,
+    cache=None,
+    flush_interval: float = 30.0,
+    checkpoint_store=None,
+    options: ClassificationOptions = None,
+    prometheus_path: str = None,
+    results: asyncio.Queue = None,
 ) -> None:
-    """Robust async labeling with master progress tracking and retry logic."""
+    """
+    Robust async labeling with master progress tracking and per-item retries.
 
-    # Master progress file in main data directory
-    master_progress_path = (
-        Path(ROOT_DIR) / "data" / "iati" / "master_classification_progress.json"
-    )
+    Pass a PredictionCache as `cache` to reuse predictions for activities whose
+    narratives were already classified by the same program. Scheduling,
+    retries and the optional compaction, packing, prefilter, cascade, priority
+    and budget modes are set by `options` (see ClassificationOptions).
+    Programs are driven through DSPy's async interface. Results are
+    checkpointed every `batch_size` completions or `flush_interval` seconds,
+    whichever comes first.
+
+    Progress is tracked in `checkpoint_store` (a CheckpointStore), which
+    defaults to the master store namespaced by the model's program fingerprint.
+
+    Failed calls are retried within the single pass; errors that exhaust their
+    class's budget are logged to errors.json with their `error_class`.
+
+    Pass an asyncio.Queue as `results` to also receive every validated result
+    as soon as it completes, before it is checkpointed; see
+    stream_classified_activities.
+
+    Per-call latency, tokens, cost, retries and errors are summarised in
+    run_summary.json in `output_dir`, and in a Prometheus textfile at
+    `prometheus_path` when given. With priorities, the share of total weight
+    classified is reported too.
+    """
+    options = options or ClassificationOptions()
+
+    # Master progress store in main data directory, one namespace per program
+    owns_store = checkpoint_store is None
+    if owns_store:
+        checkpoint_store = CheckpointStore(namespace=program_fingerprint(model))
 
     # Local output paths
-    if not output_dir:
-        output_dir = str(Path(ROOT_DIR) / "data" / "iati")
+    output_dir = output_dir or DEFAULT_OUTPUT_DIR
 
     output_path = Path(output_dir) / "classified_results.json"
     errors_path = Path(output_dir) / "errors.json"
-
-    # Load master progress using unique_id
-    master_progress = (
-        read_json(str(master_progress_path))
-        if master_progress_path.exists()
-        else {"done": set()}
-    )
-    if isinstance(master_progress["done"], list):
-        master_progress["done"] = set(master_progress["done"])
+    # Checkpoints append to JSON Lines logs that are compacted into the JSON
+    # files above once the run completes
+    results_log_path = output_path.with_suffix(".jsonl")
+    errors_log_path = errors_path.with_suffix(".jsonl")
 
     # Filter using unique_id instead of iati_identifier
-    remaining = [
-        a for a in activities if a.get("unique_id") not in master_progress["done"]
-    ]
+    remaining = checkpoint_store.remaining(activities)
 
     print(f"Processing {len(remaining)}/{len(activities)} activities")
 
-    # Retry loop until all activities are classified
-    max_retries = 3
-    retry_count = 0
-
-    while remaining and retry_count < max_retries:
-        print(f"Retry attempt {retry_count + 1}/{max_retries}")
-
-        semaphore = asyncio.Semaphore(10)
-
-        for i in range(0, len(remaining), batch_size):
-            batch = remaining[i : i + batch_size]
-
-            tasks = [
-                _classify_activity(model, activity, semaphore) for activity in batch
-            ]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-
-            successful = []
-            errors = []
-
-            for activity, result in zip(batch, results):
-                if isinstance(result, Exception):
-                    error = {
-                        "unique_id": activity.get("unique_id"),
-                        "error": str(result),
-                    }
-                    errors.append(error)
-                elif _validate_result(result):
-                    successful.append(result)
-                    master_progress["done"].add(activity.get("unique_id"))
-                else:
-                    error = {
-                        "unique_id": activity.get("unique_id"),
-                        "error": "Invalid result format",
-                    }
-                    errors.append(error)
-
-            # Save results and update master progress
-            _append_results(successful, output_path)
-            if errors:
-                _append_results(errors, errors_path)
-
-            # Save master progress (convert set to list for JSON)
-            master_progress_save = {
-                "done": list(master_progress["done"]),
-                "last_updated": datetime.now().isoformat(),
-            }
-            write_json(master_progress_save, str(master_progress_path))
+    run = _ClassificationRun(model, options, cache)
+    telemetry = run.telemetry
+    callbacks = [*dspy.settings.callbacks, TelemetryCallback(telemetry)]
 
-            print(
-                f"Batch {i//batch_size + 1}: {len(successful)}/{len(batch)} successful"
-            )
-            await asyncio.sleep(2.0)
+    # Workers pull from a shared queue so one slow activity never holds back
+    # the rest; results are checkpointed in small flushes.
+    queue = asyncio.Queue()
+    if options.dedupe:
+        representatives, groups = _group_duplicates(remaining)
+        print(
+            f"Deduplicated {len(remaining)} activities into "
+            f"{len(representatives)} distinct narratives"
+        )
+    else:
+        representatives, groups = remaining, None
+    for item in run.queue_items(representatives, groups):
+        queue.put_nowait(item)
 
-        # Update remaining list for next retry
-        remaining = [
-            a for a in activities if a.get("unique_id") not in master_progress["done"]
+    checkpoint = _CheckpointBuffer(
+        results_log_path,
+        errors_log_path,
+        checkpoint_store,
+        flush_every=batch_size,
+        flush_interval=flush_interval,
+        controller=run.controller,
+        groups=groups,
+        telemetry=telemetry,
+        results=results,
+        fields=_output_fields(model),
+    )
+    with dspy.context(callbacks=callbacks):
+        workers = [
+            asyncio.create_task(_worker(queue, run, checkpoint))
+            for _ in range(min(options.max_concurrency, len(representatives)))
         ]
-        retry_count += 1
+        try:
+            await queue.join()
+        finally:
+            # Also on cancellation, so workers stop and finished work is saved
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            checkpoint.flush()
+
+    _compact_results(results_log_path, output_path)
+    _compact_results(errors_log_path, errors_path)
 
     # Final validation
-    final_remaining = [
-        a for a in activities if a.get("unique_id") not in master_progress["done"]
-    ]
+    final_remaining = checkpoint_store.remaining(remaining)
+    if telemetry.deferred:
+        print(
+            f"Budget reached ({options.budget.reason}): {telemetry.deferred} activities "
+            f"deferred to the next run"
+        )
+    if options.priorities is not None:
+        telemetry.priority_coverage = weight_coverage(
+            activities, options.priorities, checkpoint_store
+        )
+        if telemetry.priority_coverage is not None:
+            print(
+                f"Priority coverage: {telemetry.priority_coverage:.1%} of total "
+                f"weight classified"
+            )
     if final_remaining:
         print(
-            f"WARNING: {len(final_remaining)} activities still unclassified after {max_retries} retries"
+            f"WARNING: {len(final_remaining)} activities still unclassified "
+            f"({telemetry.deferred} deferred, failures by class "
+            f"{dict(telemetry.failures_by_class)})"
         )
         unclassified_ids = [a.get("unique_id") for a in final_remaining]
         write_json(
@@ -119,56 +255,629 @@ async def label_all_activities_async(
     else:
         print("✅ All activities successfully classified!")
 
+    telemetry.failed = len(final_remaining) - telemetry.deferred
+    telemetry.write_summary(Path(output_dir) / "run_summary.json")
+    if prometheus_path:
+        telemetry.write_prometheus(prometheus_path)
+
+    if owns_store:
+        checkpoint_store.close()
+    run.report()
+    run.close()
+
+
+async def stream_classified_activities(
+    model, activities, replay: bool = True, **kwargs
+):
+    """
+    Classify activities, yielding each validated result as it completes.
+
+    Runs label_all_activities_async (which takes the same keyword arguments and
+    still writes its output files) in the background, so consumers can work on
+    results while classification continues. Errors from the run are raised
+    once the results that completed before it are consumed; closing the
+    generator early cancels the run after checkpointing finished work.
+
+    Activities already done in the checkpoint store are not classified again.
+    With `replay`, their results in `output_dir` from earlier runs are yielded
+    first, so results checkpointed before a consumer stopped are still
+    delivered; delivery is at-least-once and consumers skip ids they have
+    already handled.
+
+        async for activity in stream_classified_activities(model, activities):
+            ...
+    """
+    results = asyncio.Queue()
+    run = asyncio.create_task(
+        label_all_activities_async(model, activities, results=results, **kwargs)
+    )
+    # None marks the end of the stream, whether the run finished or failed
+    run.add_done_callback(lambda _: results.put_nowait(None))
+    try:
+        if replay:
+            for result in _earlier_results(activities, kwargs.get("output_dir")):
+                yield result
+        while (result := await results.get()) is not None:
+            yield result
+        await run
+    finally:
+        if not run.done():
+            run.cancel()
+            await asyncio.gather(run, return_exceptions=True)
+
+
+def _earlier_results(activities, output_dir=None):
+    """Latest result per unique_id of `activities` already in `output_dir`."""
+    path = Path(output_dir or DEFAULT_OUTPUT_DIR) / "classified_results.json"
+    ids = {activity.get("unique_id") for activity in activities}
+    latest = {}
+    for result in read_json_records(str(path)):
+        if result.get("unique_id") in ids:
+            latest[result.get("unique_id")] = result
+    return list(latest.values())
+
+
+class _CheckpointBuffer:
+    """Buffer worker results and flush them to disk by count or elapsed time."""
+
+    def __init__(
+        self,
+        output_path,
+        errors_path,
+        checkpoint_store,
+        flush_every: int = 50,
+        flush_interval: float = 30.0,
+        controller=None,
+        groups=None,
+        telemetry=None,
+        results=None,
+        fields=LLM_FIELDS,
+    ):
+        self.output_path = output_path
+        self.errors_path = errors_path
+        self.checkpoint_store = checkpoint_store
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.controller = controller
+        self.groups = groups
+        self.result_fields = set(fields) | RESULT_META_FIELDS
+        self.telemetry = telemetry
+        self.results = results
+        self.successful = []
+        self.errors = []
+        self.flushes = 0
+        self.last_flush = time.monotonic()
+
+    def add_result(self, activity, result):
+        if not _validate_result(result):
+            self.add_error(activity, "Invalid result format", PARSE_FAILURE)
+            return
+        for member, member_result in self._fan_out(activity, result):
+            self.successful.append(member_result)
+            self.checkpoint_store.mark_done(member.get("unique_id"))
+            if self.results is not None:
+                self.results.put_nowait(member_result)
+
+    def add_error(self, activity, error, error_class=None):
+        members = self._fan_out(activity, None)
+        for member, _ in members:
+            self.errors.append(
+                {
+                    "unique_id": member.get("unique_id"),
+                    "error": error,
+                    "error_class": error_class,
+                }
+            )
+        if self.telemetry is not None:
+            self.telemetry.record_failure(error_class, len(members))
+
+    def defer(self, activity):
+        """Leave the activity's group unclassified for a later run."""
+        if self.telemetry is not None:
+            self.telemetry.deferred += len(self._fan_out(activity, None))
+
+    def _fan_out(self, activity, result):
+        """Pair each member of the activity's duplicate group with its result."""
+        if self.groups is None:
+            return [(activity, result)]
+        digest, members = self.groups[activity.get("unique_id")]
+        if result is None:
+            return [(member, None) for member in members]
+
+        # Copy the predicted labels, overwriting any the input records already
+        # carried, and any other fields the classifier added; labels a
+        # field-scoped program did not predict keep each member's own values
+        added = {
+            k: v
+            for k, v in result.items()
+            if k in self.result_fields or k not in activity
+        }
+        added["narrative_hash"] = digest
+        added["classified_from"] = activity.get("unique_id")
+        return [(member, {**member, **added}) for member in members]
+
+    def maybe_flush(self):
+        pending = len(self.successful) + len(self.errors)
+        elapsed = time.monotonic() - self.last_flush
+        if pending >= self.flush_every or (pending and elapsed >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        pending = len(self.successful) + len(self.errors)
+        self.last_flush = time.monotonic()
+        if not pending:
+            return
+
+        # Save results before committing progress so done ids always have output
+        start = time.monotonic()
+        _append_results(self.successful, self.output_path)
+        if self.errors:
+            _append_results(self.errors, self.errors_path)
+        self.checkpoint_store.commit()
+        if self.telemetry is not None:
+            self.telemetry.record_stage("checkpoint_write", time.monotonic() - start)
+            self.telemetry.completed += len(self.successful)
+
+        self.flushes += 1
+        concurrency = (
+            f" (concurrency {self.controller.limit})" if self.controller else ""
+        )
+        print(
+            f"Checkpoint {self.flushes}: {len(self.successful)}/{pending} successful"
+            f"{concurrency}"
+        )
+        self.successful = []
+        self.errors = []
+
+
+class _ClassificationRun:
+    """Shared state for the workers of one labeling run."""
+
+    def __init__(self, model, options: ClassificationOptions, cache=None):
+        self.model = model
+        self.options = options
+        self.controller = AdaptiveConcurrencyController(
+            initial=options.concurrency, max_limit=options.max_concurrency
+        )
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=options.max_concurrency)
+        self.compaction = options.compaction
+        self.compaction_report = None
+        if options.compaction is not None:
+            self.compaction_report = CompactionReport()
+            silence_missing_inputs_warning()
+        self.pack_size = options.pack_size
+        self.pack_max_chars = options.pack_max_chars
+        self.packer = (
+            PackedClassifier.from_program(model, options.pack_size)
+            if options.pack_size > 1
+            else None
+        )
+        self.pack_stats = {"calls": 0, "activities": 0, "fallbacks": 0}
+        self.telemetry = RunTelemetry()
+        self.retry_policy = options.retry_policy
+        self.weights = None
+        self.budget = options.budget
+        if self.budget is not None:
+            self.budget.start()
+        self.cascade = None
+        if options.strong_lm is not None:
+            self.cascade = ModelCascade(
+                model, options.strong_lm, options.consistency_threshold
+            )
+            # Answers cached without the cascade never went through its
+            # checks, so cascaded ones are cached apart
+            if cache is not None:
+                self.cache = PredictionCache(
+                    self.cascade.cache_fingerprint(cache.fingerprint),
+                    cache.path,
+                    cache.max_entries,
+                )
+        self.owns_cache = self.cache is not cache
+        self.prefilter = options.prefilter
+        self.routes = {"full": 0, "light": 0}
+        self.light_model = make_light_classifier() if self.prefilter else None
+        self.light_cache = None
+        if self.prefilter and cache is not None:
+            self.light_cache = PredictionCache(
+                program_fingerprint(self.light_model), cache.path
+            )
+
+    def route(self, activity):
+        """Route an activity to the "full" or "light" program."""
+        route = "full"
+        if self.prefilter:
+            route, _ = prefilter_activity(_raw_narratives(activity))
+        self.routes[route] += 1
+        return route
+
+    def program(self, route):
+        """(model, cache) for a route."""
+        if route == "light":
+            return self.light_model, self.light_cache
+        return self.model, self.cache
+
+    def queue_items(self, activities, groups=None):
+        """
+        Single activities, with short ones grouped into packs when enabled.
+
+        With priorities, items are ordered heaviest first: a representative
+        weighs the sum of its duplicate group and a pack the sum of its members.
+        """
+        if self.options.priorities is not None:
+            self.weights = _group_weights(activities, groups, self.options.priorities)
+        if self.weights is not None:
+            activities = sorted(activities, key=self.weight, reverse=True)
+        if self.packer is None:
+            return list(activities)
+        short, others = [], []
+        for activity in activities:
+            narratives = _raw_narratives(activity)
+            # Activities routed to the light program are classified on their own
+            full = not self.prefilter or prefilter_activity(narratives)[0] == "full"
+            packable = full and is_packable(narratives, self.pack_max_chars)
+            (short if packable else others).append(activity)
+        packs = [
+            pack if len(pack) > 1 else pack[0]
+            for pack in pack_activities(short, self.pack_size)
+        ]
+        if self.weights is not None:
+            return sorted(packs + others, key=self.weight, reverse=True)
+        return packs + others
 
-async def _classify_activity(model, activity, semaphore):
-    """Classify single activity with proper error handling."""
-    async with semaphore:
+    def packed_result(self, activity, pred_dict):
+        """Result for a pack member labeled without a single-activity call."""
+        result = _labeled(activity, pred_dict)
+        if self.prefilter:
+            self.routes["full"] += 1
+            result["prefilter_route"] = "full"
+        return result
+
+    def weight(self, item):
+        if isinstance(item, list):
+            return sum(self.weight(activity) for activity in item)
+        return self.weights.get(item.get("unique_id"), 0.0)
+
+    def over_budget(self):
+        return self.budget is not None and self.budget.exhausted(self.telemetry)
+
+    def prepare_inputs(self, activity):
+        """Narrative inputs for the program, compacted when enabled."""
+        narratives = _raw_narratives(activity)
+        if self.compaction is None:
+            return narratives
+        narratives, stats = compact_narratives(narratives, **self.compaction)
+        self.compaction_report.add(stats)
+        return narratives
+
+    def report(self):
+        self.telemetry.report()
+        if self.telemetry.retries or self.telemetry.failures_by_class:
+            print(
+                f"Retries by class: {dict(self.telemetry.retries_by_class)}; "
+                f"gave up: {dict(self.telemetry.failures_by_class)}"
+            )
+        self.controller.report()
+        if self.cache is not None:
+            self.cache.report()
+        if self.compaction_report is not None:
+            self.compaction_report.report()
+        if self.pack_stats["calls"]:
+            stats = self.pack_stats
+            print(
+                f"Packed calls: {stats['calls']} for {stats['activities']} activities "
+                f"({stats['activities'] / stats['calls']:.1f} per call), "
+                f"{stats['fallbacks']} fell back to single calls"
+            )
+        if self.prefilter:
+            total = sum(self.routes.values())
+            print(
+                f"Prefilter: {self.routes['full']} full, {self.routes['light']} light "
+                f"({self.routes['light'] / total if total else 0:.1%} skipped full model)"
+            )
+        if self.light_cache is not None:
+            self.light_cache.report()
+        if self.cascade is not None:
+            self.cascade.report(self.telemetry)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if self.owns_cache:
+            self.cache.close()
+        if self.light_cache is not None:
+            self.light_cache.close()
+
+
+def _raw_narratives(activity):
+    return {field: activity.get(field, "") for field in NARRATIVE_FIELDS}
+
+
+def _group_weights(representatives, groups, priorities):
+    """Weight of each representative: the summed priority of its duplicate group."""
+    weights = {}
+    for activity in representatives:
+        unique_id = activity.get("unique_id")
+        members = groups[unique_id][1] if groups is not None else [activity]
+        weights[unique_id] = sum(
+            priorities.get(member.get("unique_id"), 0.0) for member in members
+        )
+    return weights
+
+
+def _group_duplicates(activities):
+    """
+    Group activities by a hash of their narrative fields.
+
+    Returns:
+        tuple: (one representative per group,
+                {representative unique_id: (narrative hash, members)})
+    """
+    by_hash = {}
+    for activity in activities:
+        by_hash.setdefault(narrative_hash(_raw_narratives(activity)), []).append(
+            activity
+        )
+    groups = {
+        members[0].get("unique_id"): (digest, members)
+        for digest, members in by_hash.items()
+    }
+    return [members[0] for members in by_hash.values()], groups
+
+
+async def _worker(queue, run, checkpoint):
+    """Pull activities off the queue until cancelled."""
+    while True:
+        item = await queue.get()
+        try:
+            if run.over_budget():
+                # Drain without classifying so the run ends cleanly
+                for activity in item if isinstance(item, list) else [item]:
+                    checkpoint.defer(activity)
+            elif isinstance(item, list):
+                await _classify_pack(run, item, checkpoint)
+            else:
+                await _classify_into(run, item, checkpoint)
+        finally:
+            queue.task_done()
+        checkpoint.maybe_flush()
+
+
+async def _classify_into(run, activity, checkpoint, narratives=None):
+    """Classify one activity, retrying failures until their class's budget runs out."""
+    policy = run.retry_policy
+    attempts = Counter()
+    while True:
         try:
-            narratives = {field: activity.get(field, "") for field in NARRATIVE_FIELDS}
-            # Run model in thread pool since DSPy isn't async
-            pred = await asyncio.to_thread(model, **narratives)
-
-            result = activity.copy()
-            pred_dict = pred.toDict() if hasattr(pred, "toDict") else pred.__dict__
-
-            for field in [
-                "llm_ref_group",
-                "llm_target_population",
-                "llm_ref_setting",
-                "llm_geographic_focus",
-                "llm_nexus",
-                "llm_funding_org",
-                "llm_implementing_org",
-            ]:
-                result[field] = pred_dict.get(field, [])
-
-            result["classified_at"] = datetime.now().isoformat()
-            return result
+            result = await _classify_activity(run, activity, narratives)
+            if not _validate_result(result):
+                raise ClassificationError("Invalid result format", PARSE_FAILURE)
+        except BudgetExhausted:
+            checkpoint.defer(activity)
+            return
+        except Exception as e:
+            error_class = classify_error(e)
+            attempts[error_class] += 1
+            if not policy.should_retry(error_class, attempts[error_class]):
+                checkpoint.add_error(activity, str(e), error_class)
+                return
+            if run.over_budget():
+                checkpoint.defer(activity)
+                return
+            run.telemetry.record_retry(error_class)
+            # Back off outside the concurrency slot so other activities proceed
+            await asyncio.sleep(policy.delay(attempts[error_class]))
+        else:
+            checkpoint.add_result(activity, result)
+            return
+
+
+async def _classify_pack(run, pack, checkpoint):
+    """Classify uncached activities of a pack in one call, falling back to single calls."""
+    misses = []
+    for activity in pack:
+        narratives = run.prepare_inputs(activity)
+        pred_dict = run.cache.get(narratives) if run.cache is not None else None
+        if pred_dict is None:
+            misses.append((activity, narratives))
+        else:
+            run.telemetry.cache_hits += 1
+            checkpoint.add_result(activity, run.packed_result(activity, pred_dict))
+    if not misses:
+        return
 
+    labels = [None] * len(misses)
+    if len(misses) > 1:
+        try:
+            async with _timed_slot(run):
+                start = time.monotonic()
+                try:
+                    labels = await run.packer.acall(
+                        [_raw_narratives(activity) for activity, _ in misses]
+                    )
+                except Exception as e:
+                    run.telemetry.record_call("packed", time.monotonic() - start, e)
+                    raise
+                run.telemetry.record_call("packed", time.monotonic() - start)
+            run.pack_stats["calls"] += 1
+            run.pack_stats["activities"] += len(misses)
+        except BudgetExhausted:
+            for activity, _ in misses:
+                checkpoint.defer(activity)
+            return
         except Exception as e:
-            raise Exception(f"Classification failed: {str(e)}")
+            print(f"Packed call failed, falling back to single calls: {e}")
+
+    for (activity, narratives), pred_dict in zip(misses, labels):
+        if pred_dict is not None and run.cascade is not None:
+            try:
+                async with _timed_slot(run):
+                    pred_dict = await _cascade(run, narratives, pred_dict)
+            except BudgetExhausted:
+                checkpoint.defer(activity)
+                continue
+            except Exception:
+                # The single-call fallback retries, and cascades on its own
+                pred_dict = None
+        if pred_dict is None:
+            run.pack_stats["fallbacks"] += len(misses) > 1
+            await _classify_into(run, activity, checkpoint, narratives)
+        else:
+            # Packed labels come from a different prompt, so they are not cached
+            checkpoint.add_result(activity, run.packed_result(activity, pred_dict))
+
 
+async def _classify_activity(run, activity, narratives=None):
+    """
+    Classify single activity with proper error handling.
 
-def _validate_result(result):
+    Pass `narratives` when the caller already prepared them and missed the cache.
+    """
+    route = run.route(activity)
+    model, cache = run.program(route)
+    checked = narratives is not None and cache is run.cache
+    if narratives is None:
+        # Cache on the inputs actually sent, so compaction settings are part of the key
+        narratives = run.prepare_inputs(activity)
+    pred_dict = None if checked or cache is None else cache.get(narratives)
+
+    if pred_dict is None:
+        async with _timed_slot(run) as slot:
+            # Identical narratives may have been classified while we waited
+            if cache is not None:
+                pred_dict = cache.get(narratives, recheck=True)
+                slot.record = pred_dict is None
+
+            if pred_dict is None:
+                try:
+                    pred_dict = await _timed_predict(run, route, model, narratives)
+                    if run.cascade is not None and route == "full":
+                        pred_dict = await _cascade(run, narratives, pred_dict)
+                except Exception as e:
+                    raise ClassificationError(e) from e
+
+                if cache is not None and _validate_result(
+                    pred_dict, _output_fields(model)
+                ):
+                    cache.set(narratives, pred_dict)
+            else:
+                run.telemetry.cache_hits += 1
+    else:
+        run.telemetry.cache_hits += 1
+
+    if route == "light":
+        pred_dict = apply_light_defaults(pred_dict)
+    result = _labeled(activity, pred_dict)
+    if run.prefilter:
+        result["prefilter_route"] = route
+    return result
+
+
+async def _timed_predict(run, kind, model, inputs):
+    """Predict and record the call's latency; returns the label fields."""
+    start = time.monotonic()
+    try:
+        pred = await _predict(model, inputs, run.executor)
+    except Exception as e:
+        run.telemetry.record_call(kind, time.monotonic() - start, e)
+        raise
+    run.telemetry.record_call(kind, time.monotonic() - start)
+
+    pred_dict = pred.toDict() if hasattr(pred, "toDict") else pred.__dict__
+    return {field: pred_dict.get(field, []) for field in _output_fields(model)}
+
+
+def _output_fields(model):
+    """Label fields a program predicts; field-scoped programs predict a subset."""
+    return getattr(model, "output_fields", LLM_FIELDS)
+
+
+async def _cascade(run, narratives, pred_dict):
+    """Escalate a task-model answer to the strong model when it fails checks."""
+    cascade = run.cascade
+    reason = validation_failure(pred_dict, narratives)
+    if reason is None and cascade.consistency_threshold is not None:
+        sample = await _timed_predict(
+            run,
+            "consistency_sample",
+            run.model,
+            {**narratives, "config": cascade.sample_config},
+        )
+        if agreement(pred_dict, sample) < cascade.consistency_threshold:
+            reason = "self_consistency"
+    cascade.record(reason)
+
+    if reason is None:
+        return {**pred_dict, "classified_by": "task"}
+    strong = await _timed_predict(run, "strong", cascade.strong_model, narratives)
+    return {**strong, "classified_by": "strong"}
+
+
+@asynccontextmanager
+async def _timed_slot(run):
+    """Concurrency slot that records how long the caller waited for it."""
+    start = time.monotonic()
+    async with run.controller.slot() as slot:
+        run.telemetry.record_stage("slot_wait", time.monotonic() - start)
+        # Checked here too, as many workers may have queued for a slot
+        if run.over_budget():
+            slot.record = False
+            raise BudgetExhausted(run.budget.reason)
+        yield slot
+
+
+def _labeled(activity, pred_dict):
+    result = activity.copy()
+    for field in LLM_FIELDS:
+        # Fields a field-scoped program did not predict keep their earlier labels
+        result[field] = (
+            pred_dict[field] if field in pred_dict else result.get(field, [])
+        )
+
+    if "classified_by" in pred_dict:
+        result["classified_by"] = pred_dict["classified_by"]
+
+    result["classified_at"] = datetime.now().isoformat()
+    return result
+
+
+async def _predict(model, narratives, executor=None):
+    """Call the program on the event loop, or in `executor` if it has no async path."""
+    if hasattr(model, "aforward"):
+        try:
+            return await model.acall(**narratives)
+        except NotImplementedError:
+            pass
+
+    # DSPy settings overrides are thread-local; carry the callbacks into the pool
+    callbacks = dspy.settings.callbacks
+
+    def call():
+        with dspy.context(callbacks=callbacks):
+            return model(**narratives)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, call)
+
+
+def _validate_result(result, fields=LLM_FIELDS):
     """Ensure all classification fields exist as lists."""
     if not isinstance(result, dict):
         return False
-    required = [
-        "llm_ref_group",
-        "llm_target_population",
-        "llm_ref_setting",
-        "llm_geographic_focus",
-        "llm_nexus",
-        "llm_funding_org",
-        "llm_implementing_org",
-    ]
-    return all(isinstance(result.get(field), list) for field in required)
+    return all(isinstance(result.get(field), list) for field in fields)
 
 
 def _append_results(results, output_path):
-    """Thread-safe append to file."""
+    """Append results to a JSON Lines log, fsynced so checkpoints survive crashes."""
     if not results:
         return
+    append_jsonl(results, str(output_path), fsync=True)
+
+
+def _compact_results(log_path, output_path):
+    """Fold a JSON Lines log into the final JSON list and remove the log."""
+    if not log_path.exists():
+        return
     existing = read_json(str(output_path)) if output_path.exists() else []
-    existing.extend(results)
-    write_json(existing, str(output_path))
+    existing.extend(read_jsonl(str(log_path)))
+    write_json_atomic(existing, str(output_path))
+    log_path.unlink()
@@ -0,0 +1,140 @@
+"""
+Task-to-strong model cascade for batch classification.
+
+Every activity is classified by the cheap task model first. The output is
+escalated to the strong model only when it fails validation: a field that is
+not a list, a value outside the signature's Literal choices, refugee labels
+that contradict each other or that nothing in the narratives supports, or
+(optionally) low agreement with a second, sampled task-model answer.
+"""
+
+import hashlib
+import json
+import typing
+from collections import Counter
+from typing import Dict, Optional
+
+from lib.dspy_classifier import IATIClassifier
+from lib.dspy_prefilter import prefilter_activity
+
+# Fields compared for self-consistency; free-text org and place lists vary too
+# much in wording to be a useful signal
+CONSISTENCY_FIELDS = [
+    "llm_ref_group",
+    "llm_target_population",
+    "llm_ref_setting",
+    "llm_nexus",
+]
+
+
+def _allowed_literals(signature=IATIClassifier) -> Dict[str, set]:
+    allowed = {}
+    for name, field in signature.output_fields.items():
+        (item_type,) = typing.get_args(field.annotation) or (None,)
+        if typing.get_origin(item_type) is typing.Literal:
+            allowed[name] = set(typing.get_args(item_type))
+    return allowed
+
+
+ALLOWED_LITERALS = _allowed_literals()
+
+
+def validation_failure(pred_dict: Dict, narratives: Dict) -> Optional[str]:
+    """Name of the first failed check, or None if the output looks sound."""
+    fields = IATIClassifier.output_fields
+    if not all(isinstance(pred_dict.get(f), list) for f in fields):
+        return "invalid_format"
+
+    for field, allowed in ALLOWED_LITERALS.items():
+        if not set(pred_dict[field]) <= allowed:
+            return "disallowed_literal"
+
+    has_group = bool(pred_dict["llm_ref_group"])
+    targets_refugees = "refugees" in pred_dict["llm_target_population"]
+    if has_group != targets_refugees:
+        return "inconsistent_refugee_labels"
+
+    route, _ = prefilter_activity(narratives)
+    if has_group and route == "light":
+        return "unsupported_refugee_label"
+    return None
+
+
+def agreement(first: Dict, second: Dict, fields=CONSISTENCY_FIELDS) -> float:
+    """Mean Jaccard similarity of two label dicts over `fields`."""
+    scores = []
+    for field in fields:
+        a, b = set(first.get(field) or []), set(second.get(field) or [])
+        scores.append(len(a & b) / len(a | b) if a | b else 1.0)
+    return sum(scores) / len(scores)
+
+
+class ModelCascade:
+    """
+    Strong-model fallback for a task-model program.
+
+    Args:
+        task_model: The loaded program; copied and pointed at `strong_lm`
+        strong_lm: dspy.LM used for escalations
+        consistency_threshold: When set, sample a second task-model answer at
+            `sample_temperature` and escalate if agreement falls below this
+    """
+
+    def __init__(
+        self,
+        task_model,
+        strong_lm,
+        consistency_threshold: float = None,
+        sample_temperature: float = 0.7,
+    ):
+        # A per-program LM rather than dspy.context, which is thread-local and
+        # would leak into every task interleaved on the event loop
+        self.strong_model = task_model.deepcopy()
+        self.strong_model.set_lm(strong_lm)
+        self.strong_lm = strong_lm
+        self.consistency_threshold = consistency_threshold
+        self.sample_config = {"temperature": sample_temperature}
+        self.checked = 0
+        self.escalations = Counter()
+
+    def cache_fingerprint(self, task_fingerprint: str) -> str:
+        """Prediction cache namespace for cascaded answers of the task program."""
+        payload = json.dumps(
+            {
+                "task": task_fingerprint,
+                "strong_lm": getattr(self.strong_lm, "model", None),
+                "consistency_threshold": self.consistency_threshold,
+                "sample_config": self.sample_config,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def record(self, reason: Optional[str]) -> None:
+        self.checked += 1
+        if reason:
+            self.escalations[reason] += 1
+
+    def summary(self, telemetry=None) -> Dict:
+        escalated = sum(self.escalations.values())
+        summary = {
+            "checked": self.checked,
+            "escalated": escalated,
+            "escalation_rate": escalated / self.checked if self.checked else 0.0,
+            "reasons": dict(self.escalations),
+        }
+        if telemetry is not None:
+            summary["by_model"] = telemetry.summary()["by_model"]
+        return summary
+
+    def report(self, telemetry=None) -> None:
+        summary = self.summary(telemetry)
+        print(
+            f"Cascade: {summary['escalated']}/{summary['checked']} escalated to "
+            f"{self.strong_lm.model} ({summary['escalation_rate']:.1%}) "
+            f"{summary['reasons']}"
+        )
+        for model, usage in summary.get("by_model", {}).items():
+            cost = usage["cost_usd"]
+            cost = f"${cost:.4f}" if cost is not None else "cost unknown"
+            print(f"    {model}: {usage['requests']} requests, {cost}")
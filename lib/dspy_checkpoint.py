@@ -0,0 +1,95 @@
+"""
+Classification progress checkpoints.
+
+CheckpointStore records which activities (by unique_id) have been classified
+in a SQLite table namespaced by program fingerprint, so marking an activity
+done is a single-row insert and progress made with one model version does not
+suppress classification under another.
+"""
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, List
+
+from definitions import ROOT_DIR
+from lib.util_file import read_json
+
+CHECKPOINT_DB_PATH = (
+    Path(ROOT_DIR) / "data" / "iati" / "master_classification_progress.sqlite"
+)
+LEGACY_PROGRESS_PATH = (
+    Path(ROOT_DIR) / "data" / "iati" / "master_classification_progress.json"
+)
+
+
+class CheckpointStore:
+    """Namespaced set of classified unique_ids backed by SQLite."""
+
+    def __init__(self, namespace: str = "default", path: Path = CHECKPOINT_DB_PATH):
+        self.namespace = namespace
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS done (
+                namespace TEXT NOT NULL,
+                unique_id TEXT NOT NULL,
+                done_at REAL NOT NULL,
+                PRIMARY KEY (namespace, unique_id)
+            ) WITHOUT ROWID
+            """
+        )
+        self.conn.commit()
+
+        # In-memory mirror so membership checks never hit the database
+        self._done = {
+            row[0]
+            for row in self.conn.execute(
+                "SELECT unique_id FROM done WHERE namespace = ?", (namespace,)
+            )
+        }
+
+    def __contains__(self, unique_id) -> bool:
+        return unique_id in self._done
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def mark_done(self, unique_id: str) -> None:
+        """Record one classified activity; durable after the next commit()."""
+        if unique_id in self._done:
+            return
+        self._done.add(unique_id)
+        self.conn.execute(
+            "INSERT OR IGNORE INTO done VALUES (?, ?, ?)",
+            (self.namespace, unique_id, time.time()),
+        )
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def remaining(self, activities: Iterable[dict]) -> List[dict]:
+        """Activities whose unique_id has not been marked done in this namespace."""
+        return [a for a in activities if a.get("unique_id") not in self._done]
+
+    def import_legacy_progress(self, legacy_path: Path = LEGACY_PROGRESS_PATH) -> int:
+        """
+        Copy ids from the old master_classification_progress.json into this
+        namespace. Only do this when the ids were produced by the same program.
+        """
+        legacy_path = Path(legacy_path)
+        if not legacy_path.exists():
+            return 0
+        before = len(self)
+        for unique_id in read_json(str(legacy_path)).get("done", []):
+            self.mark_done(unique_id)
+        self.commit()
+        return len(self) - before
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
@@ -1,9 +1,14 @@
+import asyncio
+import os
 import random
+from collections import Counter
 from typing import List, Literal
 
 import dspy
 
 from definitions import DSPY_CONFIG, GEMINI_API_KEY
+from lib.dspy_retry import RetryPolicy, classify_error
+from lib.util_file import append_jsonl, read_jsonl
 
 
 class IATIClassifier(dspy.Signature):
@@ -303,6 +308,9 @@ class IATIClassifier(dspy.Signature):
     )
 
 
+LLM_FIELDS = list(IATIClassifier.output_fields)
+
+
 def smart_sample(activities: List[dict], n: int = 150) -> List[dict]:
     """Sample diverse activities including those without descriptions."""
     with_desc = [a for a in activities if a.get("description_narrative")]
@@ -325,149 +333,95 @@ def smart_sample(activities: List[dict], n: int = 150) -> List[dict]:
     return sample
 
 
-def generate_labels(activities: List[dict], model: str) -> List[dict]:
-    """Generate initial labels using strong model."""
-    lm = dspy.LM(model)
+def generate_labels(
+    activities: List[dict],
+    model: str,
+    progress_path: str = None,
+    concurrency: int = 8,
+) -> List[dict]:
+    """
+    Generate initial labels using strong model.
+
+    Runs generate_labels_async on a new event loop; await that directly from
+    code that already runs in one.
+    """
+    return asyncio.run(
+        generate_labels_async(activities, model, progress_path, concurrency)
+    )
+
+
+async def generate_labels_async(
+    activities: List[dict],
+    model: str,
+    progress_path: str = None,
+    concurrency: int = 8,
+) -> List[dict]:
+    """
+    Generate initial labels using strong model.
+
+    Up to `concurrency` activities are labeled at once, with transient errors
+    retried per lib.dspy_retry. With `progress_path` (a JSON Lines file), each
+    labeled activity is appended as soon as it is done and activities already
+    in the file are skipped, so an interrupted run resumes where it stopped.
+    Activities that still fail are reported and left for the next run.
+    """
     classifier = dspy.ChainOfThought(IATIClassifier)
-
-    labeled = []
-    with dspy.context(lm=lm):
-        for i, activity in enumerate(activities):
+    # A per-program LM rather than dspy.context, which is thread-local
+    classifier.set_lm(dspy.LM(model))
+
+    labeled = {}
+    if progress_path and os.path.exists(progress_path):
+        labeled = {_label_key(a): a for a in read_jsonl(progress_path)}
+    pending = [a for a in activities if _label_key(a) not in labeled]
+    print(
+        f"Labeling {len(pending)}/{len(activities)} activities "
+        f"({len(activities) - len(pending)} already labeled)"
+    )
+
+    semaphore = asyncio.Semaphore(concurrency)
+    policy = RetryPolicy()
+    failed = []
+
+    async def label(activity):
+        attempts = Counter()
+        inputs = {
+            field: activity.get(field, "") for field in IATIClassifier.input_fields
+        }
+        while True:
             try:
-                result = classifier(
-                    reporting_org_narrative=activity.get("reporting_org_narrative", ""),
-                    title_narrative=activity.get("title_narrative", ""),
-                    description_narrative=activity.get("description_narrative", ""),
-                    participating_org_narrative=activity.get(
-                        "participating_org_narrative", ""
-                    ),
-                    other_identifier_owner_org_narrative=activity.get(
-                        "other_identifier_owner_org_narrative", ""
-                    ),
-                    activity_date_narrative=activity.get("activity_date_narrative", ""),
-                    location_name_narrative=activity.get("location_name_narrative", ""),
-                    location_description_narrative=activity.get(
-                        "location_description_narrative", ""
-                    ),
-                    location_activity_description_narrative=activity.get(
-                        "location_activity_description_narrative", ""
-                    ),
-                    sector_narrative=activity.get("sector_narrative", ""),
-                    tag_narrative=activity.get("tag_narrative", ""),
-                    country_budget_items_budget_item_description_narrative=activity.get(
-                        "country_budget_items_budget_item_description_narrative", ""
-                    ),
-                    humanitarian_scope_narrative=activity.get(
-                        "humanitarian_scope_narrative", ""
-                    ),
-                    policy_marker_narrative=activity.get("policy_marker_narrative", ""),
-                    planned_disbursement_provider_org_narrative=activity.get(
-                        "planned_disbursement_provider_org_narrative", ""
-                    ),
-                    planned_disbursement_receiver_org_narrative=activity.get(
-                        "planned_disbursement_receiver_org_narrative", ""
-                    ),
-                    transaction_description_narrative=activity.get(
-                        "transaction_description_narrative", ""
-                    ),
-                    transaction_provider_org_narrative=activity.get(
-                        "transaction_provider_org_narrative", ""
-                    ),
-                    transaction_receiver_org_narrative=activity.get(
-                        "transaction_receiver_org_narrative", ""
-                    ),
-                    document_link_title_narrative=activity.get(
-                        "document_link_title_narrative", ""
-                    ),
-                    document_link_description_narrative=activity.get(
-                        "document_link_description_narrative", ""
-                    ),
-                    conditions_condition_narrative=activity.get(
-                        "conditions_condition_narrative", ""
-                    ),
-                    result_title_narrative=activity.get("result_title_narrative", ""),
-                    result_description_narrative=activity.get(
-                        "result_description_narrative", ""
-                    ),
-                    result_document_link_title_narrative=activity.get(
-                        "result_document_link_title_narrative", ""
-                    ),
-                    result_document_link_description_narrative=activity.get(
-                        "result_document_link_description_narrative", ""
-                    ),
-                    result_indicator_title_narrative=activity.get(
-                        "result_indicator_title_narrative", ""
-                    ),
-                    result_indicator_description_narrative=activity.get(
-                        "result_indicator_description_narrative", ""
-                    ),
-                    result_indicator_document_link_title_narrative=activity.get(
-                        "result_indicator_document_link_title_narrative", ""
-                    ),
-                    result_indicator_document_link_description_narrative=activity.get(
-                        "result_indicator_document_link_description_narrative", ""
-                    ),
-                    result_indicator_baseline_document_link_title_narrative=activity.get(
-                        "result_indicator_baseline_document_link_title_narrative", ""
-                    ),
-                    result_indicator_baseline_document_link_description_narrative=activity.get(
-                        "result_indicator_baseline_document_link_description_narrative",
-                        "",
-                    ),
-                    result_indicator_baseline_comment_narrative=activity.get(
-                        "result_indicator_baseline_comment_narrative", ""
-                    ),
-                    result_indicator_period_target_comment_narrative=activity.get(
-                        "result_indicator_period_target_comment_narrative", ""
-                    ),
-                    result_indicator_period_target_document_link_title_narrative=activity.get(
-                        "result_indicator_period_target_document_link_title_narrative",
-                        "",
-                    ),
-                    result_indicator_period_target_document_link_description_narrative=activity.get(
-                        "result_indicator_period_target_document_link_description_narrative",
-                        "",
-                    ),
-                    result_indicator_period_actual_comment_narrative=activity.get(
-                        "result_indicator_period_actual_comment_narrative", ""
-                    ),
-                    result_indicator_period_actual_document_link_title_narrative=activity.get(
-                        "result_indicator_period_actual_document_link_title_narrative",
-                        "",
-                    ),
-                    result_indicator_period_actual_document_link_description_narrative=activity.get(
-                        "result_indicator_period_actual_document_link_description_narrative",
-                        "",
-                    ),
-                    iati_identifier=activity.get("iati_identifier", ""),
-                    iati_identifier_exact=activity.get("iati_identifier_exact", ""),
-                )
-
-                activity_copy = activity.copy()
-                result_dict = result.toDict()
-                activity_copy.update(
-                    {
-                        "llm_ref_group": result_dict.get("llm_ref_group"),
-                        "llm_target_population": result_dict.get(
-                            "llm_target_population"
-                        ),
-                        "llm_ref_setting": result_dict.get("llm_ref_setting"),
-                        "llm_geographic_focus": result_dict.get("llm_geographic_focus"),
-                        "llm_nexus": result_dict.get("llm_nexus"),
-                        "llm_funding_org": result_dict.get("llm_funding_org"),
-                        "llm_implementing_org": result_dict.get("llm_implementing_org"),
-                        # Initialize tracking fields
-                        "human_edited": 0,
-                        "notes": "",
-                        "unclear": 0,
-                    }
-                )
-                labeled.append(activity_copy)
-                print(
-                    f"Classified activity number {i}...:\nTitle:\n{activity.get('title_narrative')} \n Description:\n{activity.get('description_narrative')} \n Classification: \n{result_dict}"
-                )
+                async with semaphore:
+                    result = await classifier.acall(**inputs)
+                break
             except Exception as e:
-                print(f"Error: {e}")
-                continue
-    print("Classified all results.")
-    return labeled
+                error_class = classify_error(e)
+                attempts[error_class] += 1
+                if not policy.should_retry(error_class, attempts[error_class]):
+                    print(f"Error labeling {_label_key(activity)} ({error_class}): {e}")
+                    failed.append(activity)
+                    return
+                await asyncio.sleep(policy.delay(attempts[error_class]))
+
+        result_dict = result.toDict()
+        activity_copy = activity.copy()
+        activity_copy.update({field: result_dict.get(field) for field in LLM_FIELDS})
+        # Initialize tracking fields
+        activity_copy.update({"human_edited": 0, "notes": "", "unclear": 0})
+        labeled[_label_key(activity)] = activity_copy
+        if progress_path:
+            append_jsonl([activity_copy], progress_path, fsync=True)
+        print(
+            f"Classified {len(labeled)}/{len(activities)}: "
+            f"{activity.get('title_narrative')}\n{result_dict}"
+        )
+
+    await asyncio.gather(*(label(activity) for activity in pending))
+
+    if failed:
+        print(f"WARNING: {len(failed)} activities failed; re-run to retry them")
+    else:
+        print("Classified all results.")
+    return [labeled[_label_key(a)] for a in activities if _label_key(a) in labeled]
+
+
+def _label_key(activity: dict) -> str:
+    return activity.get("unique_id") or activity.get("iati_identifier")
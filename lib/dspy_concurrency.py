@@ -0,0 +1,176 @@
+"""
+Adaptive concurrency control for LM requests.
+
+AdaptiveConcurrencyController is an additive-increase / multiplicative-decrease
+(AIMD) limiter: it allows one more in-flight request after each healthy window
+of calls and cuts the limit on rate limits or timeouts, pausing new requests
+briefly so the provider can recover. Throttles are judged by their rate over
+the most recent calls, so occasional ones within the tolerated error rate are
+just retried and the cut grows with the rate up to `backoff_factor`.
+"""
+
+import asyncio
+import statistics
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from lib.dspy_retry import RATE_LIMIT, TIMEOUT, classify_error
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """True for rate limit and timeout errors that call for backing off."""
+    return classify_error(error) in (RATE_LIMIT, TIMEOUT)
+
+
+class SlotHandle:
+    record = True
+
+
+class AdaptiveConcurrencyController:
+    """AIMD limit on the number of in-flight LM calls."""
+
+    def __init__(
+        self,
+        initial: int = 10,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        window: int = 20,
+        max_error_rate: float = 0.05,
+        latency_tolerance: float = 2.0,
+        backoff_factor: float = 0.5,
+        backoff_pause: float = 2.0,
+    ):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window = window
+        self.max_error_rate = max_error_rate
+        self.latency_tolerance = latency_tolerance
+        self.backoff_factor = backoff_factor
+        self.backoff_pause = backoff_pause
+
+        self.in_flight = 0
+        self.throttles = 0
+        self.baseline_latency: Optional[float] = None
+        self.limit_history: List[int] = [initial]
+        self._latencies: List[float] = []
+        self._errors = 0
+        self._recent_throttles = deque(maxlen=window)
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold one concurrency slot and record the call's latency and outcome.
+
+        Set `record = False` on the yielded handle when the slot ends up unused
+        (e.g. a cache hit) so it does not count as a latency sample.
+        """
+        await self.acquire()
+        handle = SlotHandle()
+        start = time.monotonic()
+        try:
+            yield handle
+        except Exception as e:
+            await self.release(time.monotonic() - start, e, handle.record)
+            raise
+        else:
+            await self.release(time.monotonic() - start, record=handle.record)
+
+    async def acquire(self) -> None:
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            async with self._condition:
+                paused = time.monotonic() < self._paused_until
+                if self.in_flight < self.limit and not paused:
+                    self.in_flight += 1
+                    return
+                await self._condition.wait()
+
+    async def release(
+        self, latency: float, error: Exception = None, record: bool = True
+    ) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            if record:
+                self._record(latency, error)
+            self._condition.notify_all()
+
+    def _record(self, latency: float, error: Exception = None) -> None:
+        throttled = error is not None and is_throttle_error(error)
+        self._recent_throttles.append(throttled)
+        if throttled:
+            self.throttles += 1
+            throttle_rate = sum(self._recent_throttles) / self.window
+            if throttle_rate > self.max_error_rate:
+                self._decrease(latency, max(self.backoff_factor, 1 - throttle_rate))
+            return
+
+        if error is not None:
+            self._errors += 1
+        else:
+            self._latencies.append(latency)
+
+        if len(self._latencies) + self._errors < self.window:
+            return
+
+        calls = len(self._latencies) + self._errors
+        error_rate = self._errors / calls
+        median_latency = (
+            statistics.median(self._latencies) if self._latencies else float("inf")
+        )
+        if self.baseline_latency is None or median_latency < self.baseline_latency:
+            self.baseline_latency = median_latency
+
+        healthy = (
+            error_rate <= self.max_error_rate
+            and median_latency <= self.baseline_latency * self.latency_tolerance
+        )
+        if healthy and self.limit < self.max_limit:
+            self._set_limit(self.limit + 1)
+        elif not healthy:
+            self._decrease(median_latency)
+
+        self._latencies = []
+        self._errors = 0
+
+    def _decrease(self, latency: float, factor: float = None) -> None:
+        """
+        Multiplicative decrease and pause, at most once per in-flight generation.
+
+        Throttles from calls already in flight when the limit was cut neither
+        cut it again nor extend the pause. `factor` defaults to backoff_factor.
+        """
+        now = time.monotonic()
+        if now - self._last_decrease < max(latency, self.backoff_pause):
+            return
+        self._last_decrease = now
+        factor = self.backoff_factor if factor is None else factor
+        # A full cut pauses for backoff_pause, milder cuts proportionally less
+        pause = self.backoff_pause * (1 - factor) / (1 - self.backoff_factor)
+        self._paused_until = max(self._paused_until, now + pause)
+        self._set_limit(max(self.min_limit, int(self.limit * factor)))
+
+    def _set_limit(self, limit: int) -> None:
+        if limit != self.limit:
+            print(f"Concurrency limit {self.limit} -> {limit}")
+        self.limit = limit
+        self.limit_history.append(limit)
+
+    def converged_limit(self) -> int:
+        """Median of the most recent limit changes."""
+        return int(statistics.median(self.limit_history[-10:]))
+
+    def report(self) -> None:
+        print(
+            f"Concurrency converged at {self.converged_limit()} "
+            f"(final {self.limit}, peak {max(self.limit_history)}, "
+            f"{self.throttles} throttled calls)"
+        )
@@ -0,0 +1,245 @@
+"""
+Field-scoped classification and partial re-classification.
+
+FieldScopedClassifier splits IATIClassifier into one chain-of-thought
+predictor per group of related output fields. Each group's fingerprint
+covers its instructions, field descriptions, Literal choices and demos, and
+is recorded in field_versions.json next to the results it produced, so after
+editing one field only the groups whose fingerprint changed are re-run and
+their labels merged into the existing results:
+
+    await reclassify_changed_fields(
+        "data/iati/batch-classify/<run>/classified_results.json",
+        output_dir="data/iati/batch-classify/<new run>",
+        program=load_saved_model("best_model.json"),
+    )
+
+Built from a loaded program, each group predictor carries the program's
+optimized instructions and its demos cut down to the group's fields, so
+re-run labels are steered like the ones they are merged beside.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List
+
+import dspy
+
+from lib.dspy_batch_classify import label_all_activities_async
+from lib.dspy_checkpoint import CheckpointStore
+from lib.dspy_classifier import IATIClassifier
+from lib.dspy_packed_classify import label_predictor
+from lib.dspy_prediction_cache import PredictionCache, program_fingerprint
+from lib.util_file import read_json, read_json_records, write_json
+
+# Refugee group and target population are checked against each other, so
+# they are predicted together
+FIELD_GROUPS = {
+    "refugee": ["llm_ref_group", "llm_target_population"],
+    "setting": ["llm_ref_setting"],
+    "geography": ["llm_geographic_focus"],
+    "nexus": ["llm_nexus"],
+    "organisations": ["llm_funding_org", "llm_implementing_org"],
+}
+FIELD_VERSIONS_FILE = "field_versions.json"
+
+
+def make_group_signature(group: str, signature=IATIClassifier):
+    """`signature` with every output outside `group` removed."""
+    scoped = signature
+    for name in signature.output_fields:
+        if name not in FIELD_GROUPS[group]:
+            scoped = scoped.delete(name)
+    return scoped
+
+
+def group_demos(demos: List, group: str, signature=IATIClassifier) -> List:
+    """Demos labeled for every field of `group`, cut down to its inputs and fields."""
+    fields = [*signature.input_fields, *FIELD_GROUPS[group]]
+    return [
+        dspy.Example(**{name: demo.get(name) for name in fields})
+        for demo in demos
+        if all(demo.get(field) is not None for field in FIELD_GROUPS[group])
+    ]
+
+
+class FieldScopedClassifier(dspy.Module):
+    """
+    One ChainOfThought predictor per field group, merged into one prediction.
+
+    Args:
+        groups: FIELD_GROUPS keys to predict; all groups by default
+        signature: Signature the groups are cut from
+    """
+
+    def __init__(self, groups: List[str] = None, signature=IATIClassifier):
+        super().__init__()
+        self.groups = list(groups or FIELD_GROUPS)
+        unknown = set(self.groups) - set(FIELD_GROUPS)
+        if unknown:
+            raise ValueError(f"Unknown field groups: {sorted(unknown)}")
+        # Read by the batch runner so fields outside these groups are kept
+        self.output_fields = [f for g in self.groups for f in FIELD_GROUPS[g]]
+        for group in self.groups:
+            setattr(
+                self,
+                f"{group}_predictor",
+                dspy.ChainOfThought(make_group_signature(group, signature)),
+            )
+
+    @classmethod
+    def from_program(cls, program, groups: List[str] = None):
+        """
+        Field-scoped version of a loaded single-predictor program.
+
+        Each group keeps the program's instructions and field descriptions,
+        and the program's demos restricted to the group's fields.
+        """
+        source = label_predictor(program)
+        scoped = cls(groups, source.signature)
+        for group in scoped.groups:
+            scoped.predictor(group).predict.demos = group_demos(
+                source.demos, group, source.signature
+            )
+        return scoped
+
+    def predictor(self, group: str):
+        return getattr(self, f"{group}_predictor")
+
+    def fingerprints(self) -> Dict[str, str]:
+        """Hash of each group's instructions, fields, Literal choices and demos."""
+        # dump_state covers the signature instructions, field prefixes and
+        # descriptions, and demos
+        fingerprints = {}
+        for group in self.groups:
+            predictor = self.predictor(group)
+            fields = predictor.predict.signature.fields
+            payload = json.dumps(
+                {
+                    "state": predictor.dump_state(),
+                    "annotations": {k: str(v.annotation) for k, v in fields.items()},
+                },
+                sort_keys=True,
+                default=str,
+            )
+            fingerprints[group] = hashlib.sha256(payload.encode()).hexdigest()
+        return fingerprints
+
+    def _merge(self, predictions) -> dspy.Prediction:
+        labels = {}
+        for group, pred in zip(self.groups, predictions):
+            labels.update({field: pred.get(field) for field in FIELD_GROUPS[group]})
+        return dspy.Prediction(**labels)
+
+    def forward(self, **inputs):
+        return self._merge([self.predictor(g)(**inputs) for g in self.groups])
+
+    async def aforward(self, **inputs):
+        predictions = await asyncio.gather(
+            *(self.predictor(g).acall(**inputs) for g in self.groups)
+        )
+        return self._merge(predictions)
+
+
+def changed_groups(classifier: FieldScopedClassifier, previous: Dict) -> List[str]:
+    """Groups whose fingerprint differs from the recorded `previous` one."""
+    current = classifier.fingerprints()
+    return [g for g in classifier.groups if previous.get(g) != current[g]]
+
+
+async def reclassify_changed_fields(
+    results_path: str,
+    output_dir: str,
+    groups: List[str] = None,
+    signature=IATIClassifier,
+    use_cache: bool = False,
+    program=None,
+    **kwargs,
+) -> List[str]:
+    """
+    Re-run only changed field groups over earlier results and merge them in.
+
+    Pass the `program` that produced the results (e.g. the loaded
+    best_model.json) so groups are re-run with its optimized instructions and
+    demos; without it they are cut from the bare `signature`.
+
+    Groups are compared against field_versions.json beside `results_path`;
+    pass `groups` to choose them explicitly, e.g. for results from a
+    single-call IATIClassifier run that has no field_versions.json. Merged
+    results are written to `output_dir`, which should not be the folder being
+    read, with progress checkpointed there so running into it again resumes.
+    The current fingerprints of every group are recorded only once every
+    activity has a merged result. With `use_cache`, predictions are cached
+    per re-run program. Other keyword arguments go to
+    label_all_activities_async.
+
+    Returns:
+        list: The groups that were re-run
+    """
+    if program is not None:
+        full = FieldScopedClassifier.from_program(program)
+    else:
+        full = FieldScopedClassifier(signature=signature)
+    versions_path = os.path.join(os.path.dirname(results_path), FIELD_VERSIONS_FILE)
+    if groups is None:
+        if not os.path.exists(versions_path):
+            raise ValueError(
+                f"No {FIELD_VERSIONS_FILE} beside {results_path}; pass groups"
+            )
+        groups = changed_groups(full, read_json(versions_path))
+
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    versions_output = os.path.join(output_dir, FIELD_VERSIONS_FILE)
+    if not groups:
+        print("No field group changed; nothing to re-classify")
+        write_json(full.fingerprints(), versions_output)
+        return []
+
+    results = read_json_records(results_path)
+    if program is not None:
+        model = FieldScopedClassifier.from_program(program, groups)
+    else:
+        model = FieldScopedClassifier(groups, signature)
+    print(
+        f"Re-classifying {', '.join(model.output_fields)} "
+        f"({', '.join(groups)}) for {len(results)} activities"
+    )
+    fingerprint = program_fingerprint(model)
+    # Progress is kept in output_dir, so an interrupted re-run resumes there
+    # and activities re-run into another folder are never counted as done
+    checkpoint_store = CheckpointStore(
+        fingerprint, Path(output_dir) / "progress.sqlite"
+    )
+    cache = PredictionCache(fingerprint) if use_cache else None
+    try:
+        await label_all_activities_async(
+            model,
+            results,
+            output_dir=output_dir,
+            cache=cache,
+            checkpoint_store=checkpoint_store,
+            **kwargs,
+        )
+    finally:
+        checkpoint_store.close()
+        if cache is not None:
+            cache.close()
+
+    # Unchanged groups are carried over from the earlier results as they are,
+    # so every group is current once all activities have merged results
+    merged = {
+        r.get("unique_id")
+        for r in read_json_records(os.path.join(output_dir, "classified_results.json"))
+    }
+    missing = sum(1 for r in results if r.get("unique_id") not in merged)
+    if missing:
+        print(
+            f"Not recording {FIELD_VERSIONS_FILE}: {missing} activities have no "
+            f"re-classified result yet; re-run into {output_dir} to resume"
+        )
+    else:
+        write_json(full.fingerprints(), versions_output)
+    return groups
@@ -179,34 +179,48 @@ def log_failed_predictions(example, prediction, trace=None) -> None:
             os.unlink(temp_path)
 
 
+def score_predictions(outputs, metric) -> float:
+    """Score cached (example, prediction, score) outputs, on dspy.Evaluate's 0-100 scale."""
+    if not outputs:
+        return 0.0
+    total = sum(metric(example, prediction) for example, prediction, _ in outputs)
+    return round(100 * total / len(outputs), 2)
+
+
 def comprehensive_evaluation(model, devset):
-    """Evaluate with multiple metrics and log failed predictions."""
+    """
+    Evaluate with multiple metrics and log failed predictions.
+
+    Each dev example is predicted once; the weighted, simple and per-field
+    scores and the failure log are all computed from those predictions.
+    Examples whose prediction raised score 0 on every metric, as in
+    dspy.Evaluate.
+    """
 
-    # Main weighted metric
+    # Main weighted metric, keeping the predictions for everything else
     main_evaluator = dspy.Evaluate(
-        devset=devset, metric=weighted_metric, num_threads=10
+        devset=devset, metric=weighted_metric, num_threads=10, return_outputs=True
     )
-    main_score = main_evaluator(model)
+    main_score, outputs = main_evaluator(model)
+    simple_score = score_predictions(outputs, simple_metric)
 
     # Field-specific metrics
     field_metrics = create_field_specific_metrics()
-    field_scores = {}
-
-    for field_name, metric_func in field_metrics.items():
-        evaluator = dspy.Evaluate(devset=devset, metric=metric_func, num_threads=10)
-        field_scores[field_name] = evaluator(model)
+    field_scores = {
+        field_name: score_predictions(outputs, metric_func)
+        for field_name, metric_func in field_metrics.items()
+    }
 
     # Log failed predictions
-    for example in devset:
+    for example, prediction, _ in outputs:
         try:
-            prediction = model(**{k: v for k, v in example.toDict().items() 
-                               if not k.startswith('llm_')})
             log_failed_predictions(example, prediction)
         except Exception as e:
             print(f"Error logging failed prediction: {e}")
 
     # Log to MLflow
     mlflow.log_metric("main_weighted_score", main_score)
+    mlflow.log_metric("simple_score", simple_score)
     for field_name, score in field_scores.items():
         mlflow.log_metric(f"score_{field_name}", score)
 
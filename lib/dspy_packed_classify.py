@@ -0,0 +1,175 @@
+"""
+Packed classification of several short activities in one LM call.
+
+Activities with only a title and a sector line still pay for the full
+IATIClassifier prompt on every call. PackedClassifier sends up to `pack_size`
+short activities in one request against a batched signature whose
+instructions carry the per-field guidance once, then splits and validates the
+per-activity outputs. Anything that does not come back valid is returned as
+missing so the caller can fall back to single-activity calls.
+
+PackedClassifier.from_program carries a loaded program's optimized
+instructions, field descriptions and demos over to the packed prompt, so
+packed and single calls are steered the same way.
+"""
+
+import json
+from typing import Dict, List
+
+import dspy
+import pydantic
+
+from lib.dspy_classifier import LLM_FIELDS, IATIClassifier
+from lib.dspy_prompt_compaction import compact_narratives
+
+
+def _labels_model(signature=IATIClassifier):
+    """Pydantic model for one activity's labels, typed like the signature outputs."""
+    fields = {
+        name: (field.annotation, ...) for name, field in signature.output_fields.items()
+    }
+    return pydantic.create_model("ActivityLabels", index=(int, ...), **fields)
+
+
+def make_packed_signature(signature=IATIClassifier):
+    """Batched version of `signature` that labels a numbered list of activities."""
+    guidance = "\n\n".join(
+        f"{name}: {field.json_schema_extra['desc'].strip()}"
+        for name, field in signature.output_fields.items()
+    )
+    instructions = (
+        f"{signature.instructions}\n\n"
+        "You are given several independent activities, each with an `index`. "
+        "Classify every activity on its own and return exactly one entry per "
+        "activity with the same `index`. Field guidance:\n\n"
+        f"{guidance}"
+    )
+    return dspy.make_signature(
+        {
+            "activities": (
+                str,
+                dspy.InputField(
+                    desc="JSON list of activities, each an `index` plus its non-empty narrative fields"
+                ),
+            ),
+            "classifications": (
+                List[_labels_model(signature)],
+                dspy.OutputField(desc="One classification per activity, by index"),
+            ),
+        },
+        instructions,
+        signature_name="PackedIATIClassifier",
+    )
+
+
+def is_packable(narratives: Dict, max_chars: int = 600) -> bool:
+    """True for activities whose compacted narratives are short enough to pack."""
+    compacted, _ = compact_narratives(narratives)
+    return sum(len(v) for v in compacted.values()) <= max_chars
+
+
+def pack_activities(items: List, pack_size: int) -> List[List]:
+    return [items[i : i + pack_size] for i in range(0, len(items), pack_size)]
+
+
+def _pack_inputs(narratives_list: List[Dict]) -> str:
+    packed = []
+    for index, narratives in enumerate(narratives_list):
+        compacted, _ = compact_narratives(narratives)
+        packed.append({"index": index, **compacted})
+    return json.dumps(packed, ensure_ascii=False)
+
+
+def label_predictor(program) -> dspy.Predict:
+    """The predictor of `program` that predicts every label field."""
+    for _, predictor in program.named_predictors():
+        if set(LLM_FIELDS) <= set(predictor.signature.output_fields):
+            return predictor
+    raise ValueError("Packing needs a program with one predictor for all label fields")
+
+
+def pack_demos(demos: List, pack_size: int, signature=IATIClassifier) -> List:
+    """Single-activity demos regrouped into packed demos of up to `pack_size`."""
+    labeled = [
+        demo
+        for demo in demos
+        if all(isinstance(demo.get(field), list) for field in LLM_FIELDS)
+    ]
+    packed = []
+    for group in pack_activities(labeled, pack_size):
+        narratives = [
+            {name: demo.get(name) or "" for name in signature.input_fields}
+            for demo in group
+        ]
+        classifications = [
+            {"index": index, **{field: demo.get(field) for field in LLM_FIELDS}}
+            for index, demo in enumerate(group)
+        ]
+        packed.append(
+            dspy.Example(
+                activities=_pack_inputs(narratives), classifications=classifications
+            )
+        )
+    return packed
+
+
+class PackedClassifier(dspy.Module):
+    """Classify a list of narrative dicts in one call."""
+
+    def __init__(self, signature=IATIClassifier):
+        super().__init__()
+        self.predict = dspy.Predict(make_packed_signature(signature))
+
+    @classmethod
+    def from_program(cls, program, pack_size: int) -> "PackedClassifier":
+        """
+        Packed classifier using the instructions, fields and demos of `program`.
+
+        Raises ValueError for programs without a single predictor for all
+        label fields, such as field-scoped ones.
+        """
+        predictor = label_predictor(program)
+        signature = predictor.signature
+        # Drops chain-of-thought reasoning, which packed calls do not produce
+        for name in list(signature.output_fields):
+            if name not in LLM_FIELDS:
+                signature = signature.delete(name)
+        packer = cls(signature)
+        packer.predict.demos = pack_demos(predictor.demos, pack_size, signature)
+        return packer
+
+    def forward(self, narratives_list: List[Dict]) -> List:
+        pred = self.predict(activities=_pack_inputs(narratives_list))
+        return split_packed_output(pred, len(narratives_list))
+
+    async def aforward(self, narratives_list: List[Dict]) -> List:
+        pred = await self.predict.acall(activities=_pack_inputs(narratives_list))
+        return split_packed_output(pred, len(narratives_list))
+
+
+def split_packed_output(pred, count: int) -> List:
+    """
+    Per-activity label dicts in input order, None where an activity is missing,
+    duplicated or fails validation.
+    """
+    by_index = {}
+    duplicates = set()
+    for entry in getattr(pred, "classifications", None) or []:
+        labels = entry.model_dump() if hasattr(entry, "model_dump") else entry
+        if not isinstance(labels, dict):
+            continue
+        index = labels.get("index")
+        if index in by_index:
+            duplicates.add(index)
+        by_index[index] = labels
+
+    results = []
+    for index in range(count):
+        labels = by_index.get(index)
+        if labels is None or index in duplicates:
+            results.append(None)
+            continue
+        labels = {field: labels.get(field) for field in LLM_FIELDS}
+        valid = all(isinstance(value, list) for value in labels.values())
+        results.append(labels if valid else None)
+    return results
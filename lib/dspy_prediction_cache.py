@@ -0,0 +1,153 @@
+"""
+Persistent, content-addressed cache of classifier predictions.
+
+Entries are keyed by a hash of the narrative inputs plus a fingerprint of the
+loaded program (signature, instructions, demos and LM id), so a prediction is
+only reused when both the activity text and the program are unchanged.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import dspy
+
+from definitions import ROOT_DIR
+
+PREDICTION_CACHE_PATH = Path(ROOT_DIR) / "data" / "iati" / "prediction_cache.sqlite"
+
+
+def program_fingerprint(model, lm=None) -> str:
+    """Hash the program state (signature, instructions, demos) and the LM id."""
+    lm = lm or dspy.settings.lm
+    state = model.dump_state() if hasattr(model, "dump_state") else {}
+    payload = json.dumps(
+        {"state": state, "lm": getattr(lm, "model", None)},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def narrative_hash(narratives: Dict) -> str:
+    """Stable hash of an activity's narrative inputs."""
+    payload = json.dumps(narratives, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class PredictionCache:
+    """SQLite-backed prediction cache with least-recently-used eviction."""
+
+    def __init__(
+        self,
+        fingerprint: str,
+        path: Path = PREDICTION_CACHE_PATH,
+        max_entries: int = 100_000,
+    ):
+        self.fingerprint = fingerprint
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS predictions (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                prediction TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_used ON predictions (last_used)"
+        )
+        self.conn.commit()
+        (self.entries,) = self.conn.execute(
+            "SELECT COUNT(*) FROM predictions"
+        ).fetchone()
+
+    def key(self, narratives: Dict) -> str:
+        return hashlib.sha256(
+            f"{self.fingerprint}:{narrative_hash(narratives)}".encode()
+        ).hexdigest()
+
+    def get(self, narratives: Dict, recheck: bool = False) -> Optional[Dict]:
+        """
+        Return the cached prediction dict, or None on a miss.
+
+        Use `recheck=True` for a second lookup of the same narratives (e.g.
+        after waiting for a concurrency slot); a hit then replaces the miss
+        counted by the first lookup.
+        """
+        key = self.key(narratives)
+        row = self.conn.execute(
+            "SELECT prediction FROM predictions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            if not recheck:
+                self.misses += 1
+            return None
+
+        self.hits += 1
+        if recheck:
+            self.misses -= 1
+        self.conn.execute(
+            "UPDATE predictions SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        self.conn.commit()
+        return json.loads(row[0])
+
+    def set(self, narratives: Dict, prediction: Dict) -> None:
+        key = self.key(narratives)
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO predictions VALUES (?, ?, ?, ?)",
+            (key, self.fingerprint, json.dumps(prediction, default=str), time.time()),
+        )
+        self.entries += cursor.rowcount
+        self.conn.commit()
+
+        if self.entries > self.max_entries:
+            self._evict(self.entries - self.max_entries + self.max_entries // 10)
+
+    def _evict(self, count: int) -> None:
+        """Drop the `count` least recently used entries."""
+        cursor = self.conn.execute(
+            """
+            DELETE FROM predictions WHERE key IN (
+                SELECT key FROM predictions ORDER BY last_used LIMIT ?
+            )
+            """,
+            (count,),
+        )
+        self.conn.commit()
+        self.entries -= cursor.rowcount
+        self.evictions += cursor.rowcount
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self.entries,
+        }
+
+    def report(self) -> None:
+        stats = self.stats()
+        print(
+            f"Prediction cache: {stats['hits']}/{stats['hits'] + stats['misses']} hits "
+            f"({stats['hit_rate']:.1%}), {stats['entries']} entries, "
+            f"{stats['evictions']} evicted"
+        )
+
+    def close(self) -> None:
+        self.conn.close()
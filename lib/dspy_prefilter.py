@@ -0,0 +1,132 @@
+"""
+Deterministic prefilter in front of LLM classification.
+
+Most Jordan activities never mention refugees, displacement or the agencies
+and camps that serve them. The prefilter matches a keyword/regex index over
+every narrative field: activities with a hit go to the full classifier, the
+rest are routed to a lighter signature that skips refugee nationality and
+chain-of-thought reasoning. evaluate_prefilter measures how safe that skip is
+against the hand-labeled training set.
+
+    python -m lib.dspy_prefilter [path/to/jordan_activities_labeled.json]
+"""
+
+import os
+import re
+import sys
+from typing import Dict, List, Tuple
+
+import dspy
+
+from definitions import NARRATIVE_FIELDS, ROOT_DIR
+from lib.dspy_classifier import IATIClassifier
+from lib.util_file import read_json
+
+LABELED_DATA_PATH = os.path.join(
+    ROOT_DIR, "data", "iati", "model", "jordan_activities_labeled.json"
+)
+
+# Any match sends the activity to the full classifier. Kept deliberately broad:
+# a false positive costs one full call, a false negative loses a refugee label.
+REFUGEE_PATTERNS = {
+    "refugee": r"refug|réfugi|flücht|fluecht|asyl",
+    "displacement": r"displace|\bidps?\b|forcibly|returnee|stateless",
+    "agency": r"\bunhcr\b|\bunrwa\b|\biom\b|\bhcr\b|relief and works agency|high commissioner for refugees",
+    "camp": r"\bcamps?\b|za.?atari|zaatari|azraq|\bejc\b|emirati.?jordanian|marka|baqa.?a|jerash camp|rukban",
+    "crisis": r"syria|palestin|iraqi|yemeni|sudanese|somali|crisis response|3rp|jrp|response plan",
+    "host_community": r"host communit|host population|vulnerable jordanians",
+    "protection": r"\bprotection\b|\bpsea\b|gender.?based violence|\bgbv\b|child protection",
+}
+REFUGEE_REGEX = {
+    name: re.compile(pattern, re.IGNORECASE)
+    for name, pattern in REFUGEE_PATTERNS.items()
+}
+
+
+def _narrative_text(narratives: Dict) -> str:
+    parts = []
+    for value in narratives.values():
+        if isinstance(value, (list, tuple)):
+            parts.extend(str(v) for v in value if v)
+        elif value:
+            parts.append(str(value))
+    return "\n".join(parts)
+
+
+def prefilter_activity(narratives: Dict) -> Tuple[str, List[str]]:
+    """
+    Route one activity.
+
+    Returns:
+        tuple: ("full" or "light", names of the matched patterns)
+    """
+    text = _narrative_text(narratives)
+    matched = [name for name, regex in REFUGEE_REGEX.items() if regex.search(text)]
+    return ("full" if matched else "light"), matched
+
+
+def make_light_classifier(signature=IATIClassifier):
+    """Single-step predictor without the refugee nationality output."""
+    return dspy.Predict(signature.delete("llm_ref_group"))
+
+
+def apply_light_defaults(pred_dict: Dict) -> Dict:
+    """Fill the refugee-specific labels the light path does not predict."""
+    pred_dict = dict(pred_dict)
+    pred_dict["llm_ref_group"] = []
+    pred_dict["llm_target_population"] = [
+        v for v in pred_dict.get("llm_target_population") or [] if v != "refugees"
+    ]
+    return pred_dict
+
+
+def _is_refugee_related(activity: Dict) -> bool:
+    """Ground truth: a labeled refugee group or refugee target population."""
+    return bool(activity.get("llm_ref_group")) or "refugees" in (
+        activity.get("llm_target_population") or []
+    )
+
+
+def evaluate_prefilter(labeled: List[Dict]) -> Dict:
+    """Precision and recall of the "full" route against labeled activities."""
+    tp = fp = fn = tn = 0
+    missed = []
+    for activity in labeled:
+        narratives = {field: activity.get(field, "") for field in NARRATIVE_FIELDS}
+        route, _ = prefilter_activity(narratives)
+        actual = _is_refugee_related(activity)
+        if route == "full":
+            tp += actual
+            fp += not actual
+        else:
+            fn += actual
+            tn += not actual
+            if actual:
+                missed.append(
+                    activity.get("unique_id") or activity.get("iati_identifier")
+                )
+
+    total = tp + fp + fn + tn
+    return {
+        "activities": total,
+        "precision": tp / (tp + fp) if tp + fp else 0.0,
+        "recall": tp / (tp + fn) if tp + fn else 0.0,
+        "skip_rate": (fn + tn) / total if total else 0.0,
+        "missed_refugee_activities": missed,
+    }
+
+
+def report_prefilter(labeled_path: str = LABELED_DATA_PATH) -> Dict:
+    stats = evaluate_prefilter(read_json(labeled_path))
+    print(
+        f"Prefilter on {stats['activities']} labeled activities: "
+        f"precision {stats['precision']:.1%}, recall {stats['recall']:.1%}, "
+        f"skip rate {stats['skip_rate']:.1%}"
+    )
+    if stats["missed_refugee_activities"]:
+        print(f"Missed refugee activities: {stats['missed_refugee_activities']}")
+    return stats
+
+
+if __name__ == "__main__":
+    report_prefilter(*sys.argv[1:2])
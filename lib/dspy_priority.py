@@ -0,0 +1,120 @@
+"""
+Priority weights and budget caps for batch classification.
+
+Weights are per-activity scores keyed by unique_id; label_all_activities_async
+classifies the heaviest activities first, so a run stopped by a RunBudget has
+covered the largest share of the weight it could. Weights can come from total
+transaction value (USD transactions as built by iati_build_usd_transactions)
+or from how recently an activity last transacted.
+"""
+
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+
+def funding_weights(
+    activities: List[dict],
+    transactions: pd.DataFrame,
+    value_column: str = "transaction_value_usd",
+) -> Dict[str, float]:
+    """Total absolute transaction value per activity; 0 without transactions."""
+    totals = (
+        transactions[value_column]
+        .abs()
+        .groupby(transactions["iati_identifier"])
+        .sum(min_count=1)
+        .fillna(0.0)
+    )
+    return {
+        a.get("unique_id"): float(totals.get(a.get("iati_identifier"), 0.0))
+        for a in activities
+    }
+
+
+def recency_weights(
+    activities: List[dict],
+    transactions: pd.DataFrame,
+    date_column: str = "date",
+    half_life_days: float = 365.0,
+    now: pd.Timestamp = None,
+) -> Dict[str, float]:
+    """
+    Score in (0, 1] halving every `half_life_days` since the latest transaction.
+
+    Activities without dated transactions score 0.
+    """
+    now = now or pd.Timestamp.now()
+    dates = pd.to_datetime(transactions[date_column], errors="coerce")
+    latest = dates.groupby(transactions["iati_identifier"]).max().dropna()
+    age_days = (now - latest).dt.days.clip(lower=0)
+    scores = 0.5 ** (age_days / half_life_days)
+    return {
+        a.get("unique_id"): float(scores.get(a.get("iati_identifier"), 0.0))
+        for a in activities
+    }
+
+
+def weight_coverage(
+    activities: List[dict], weights: Dict[str, float], done
+) -> Optional[float]:
+    """Share of total weight carried by activities whose unique_id is in `done`."""
+    total = sum(weights.get(a.get("unique_id"), 0.0) for a in activities)
+    if not total:
+        return None
+    covered = sum(
+        weights.get(a.get("unique_id"), 0.0)
+        for a in activities
+        if a.get("unique_id") in done
+    )
+    return covered / total
+
+
+class BudgetExhausted(Exception):
+    """Raised instead of starting a call once a RunBudget cap is reached."""
+
+
+class RunBudget:
+    """
+    Caps after which a run stops starting new classifications.
+
+    Calls already in flight finish, so a cap can be overshot by up to the
+    concurrency limit's worth of calls. Cost is only enforced when litellm
+    can price the model.
+
+    Args:
+        max_cost_usd: Estimated LM spend for this run
+        max_calls: Classifier calls for this run, retries included
+        time_limit: Seconds since the run started
+    """
+
+    def __init__(
+        self,
+        max_cost_usd: float = None,
+        max_calls: int = None,
+        time_limit: float = None,
+    ):
+        self.max_cost_usd = max_cost_usd
+        self.max_calls = max_calls
+        self.time_limit = time_limit
+        self.started = time.monotonic()
+        self.reason = None
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        self.reason = None
+
+    def exhausted(self, telemetry) -> Optional[str]:
+        """Name of the cap reached, or None while within budget."""
+        if self.reason is None:
+            if self.max_cost_usd is not None and telemetry.cost_known:
+                if telemetry.cost >= self.max_cost_usd:
+                    self.reason = f"cost ${telemetry.cost:.4f}"
+            if self.max_calls is not None:
+                if sum(telemetry.calls.values()) >= self.max_calls:
+                    self.reason = f"{self.max_calls} calls"
+            if self.time_limit is not None:
+                if time.monotonic() - self.started >= self.time_limit:
+                    self.reason = f"{self.time_limit:g}s"
+        return self.reason
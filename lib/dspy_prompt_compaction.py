@@ -0,0 +1,172 @@
+"""
+Token-minimizing compaction of classifier narrative inputs.
+
+IATI narrative fields arrive as lists with many empty values and verbatim
+repeats (the same receiver org on every transaction, the title repeated in
+result titles). compact_narratives drops empty fields, removes repeats,
+flattens lists to compact text and caps field and total lengths, returning
+the inputs to send plus an estimate of the tokens saved.
+"""
+
+import json
+import logging
+import math
+from typing import Dict, Tuple
+
+from definitions import NARRATIVE_FIELDS
+
+# Fields that carry most classification signal keep their budget first
+PRIORITY_FIELDS = [
+    "title_narrative",
+    "description_narrative",
+    "sector_narrative",
+    "participating_org_narrative",
+    "reporting_org_narrative",
+    "transaction_provider_org_narrative",
+    "transaction_receiver_org_narrative",
+    "location_name_narrative",
+    "humanitarian_scope_narrative",
+    "tag_narrative",
+]
+
+CHARS_PER_TOKEN = 4
+
+
+class _MissingInputsFilter(logging.Filter):
+    """Silence DSPy's per-call warning about the input fields we dropped."""
+
+    def filter(self, record):
+        return "Not all input fields were provided" not in record.getMessage()
+
+
+_MISSING_INPUTS_FILTER = _MissingInputsFilter()
+
+
+def silence_missing_inputs_warning() -> None:
+    """Drop DSPy's missing-input warnings; for runs sending compacted inputs."""
+    # addFilter ignores a filter that is already installed
+    logging.getLogger("dspy.predict.predict").addFilter(_MISSING_INPUTS_FILTER)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _render_field(field: str, value) -> str:
+    """Approximate how the chat adapter renders one input field."""
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False)
+    return f"[[ ## {field} ## ]]\n{value}\n\n"
+
+
+def _as_items(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if v is not None and str(v).strip()]
+    value = str(value).strip()
+    return [value] if value else []
+
+
+def compact_narratives(
+    narratives: Dict,
+    max_field_chars: int = 1500,
+    max_total_chars: int = 12000,
+    min_dedupe_chars: int = 40,
+) -> Tuple[Dict, Dict]:
+    """
+    Compact narrative inputs for one activity.
+
+    Args:
+        narratives: field -> raw value (str or list of str)
+        max_field_chars: Cap for any single field
+        max_total_chars: Budget across all fields, spent in PRIORITY_FIELDS order
+        min_dedupe_chars: Strings at least this long that already appeared in an
+            earlier field are replaced by a reference to that field
+
+    Returns:
+        tuple: (compacted narratives, {'tokens_before', 'tokens_after', 'tokens_saved'})
+    """
+    order = [f for f in PRIORITY_FIELDS if f in narratives] + [
+        f for f in narratives if f not in PRIORITY_FIELDS
+    ]
+    first_seen = {}
+    compacted = {}
+    budget = max_total_chars
+
+    for field in order:
+        items = []
+        seen_in_field = set()
+        for item in _as_items(narratives[field]):
+            key = item.casefold()
+            if key in seen_in_field:
+                continue
+            seen_in_field.add(key)
+            if len(item) >= min_dedupe_chars and key in first_seen:
+                item = f"(same as {first_seen[key]})"
+            else:
+                first_seen.setdefault(key, field)
+            items.append(item)
+
+        if not items or budget <= 0:
+            continue
+
+        text = "; ".join(items)
+        limit = min(max_field_chars, budget)
+        if len(text) > limit:
+            text = text[: max(limit - 3, 0)].rstrip() + "..."
+        compacted[field] = text
+        budget -= len(text)
+
+    # Keep the signature's field order so prompts stay stable for caching
+    compacted = {f: compacted[f] for f in narratives if f in compacted}
+
+    tokens_before = sum(
+        estimate_tokens(_render_field(f, narratives.get(f, "")))
+        for f in NARRATIVE_FIELDS
+    )
+    tokens_after = sum(
+        estimate_tokens(_render_field(f, v)) for f, v in compacted.items()
+    )
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+    }
+    return compacted, stats
+
+
+class CompactionReport:
+    """Accumulate per-activity compaction stats over a run."""
+
+    def __init__(self):
+        self.activities = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def add(self, stats: Dict) -> None:
+        self.activities += 1
+        self.tokens_before += stats["tokens_before"]
+        self.tokens_after += stats["tokens_after"]
+
+    def summary(self) -> Dict:
+        saved = self.tokens_before - self.tokens_after
+        return {
+            "activities": self.activities,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "tokens_saved": saved,
+            "tokens_saved_per_activity": (
+                saved / self.activities if self.activities else 0.0
+            ),
+        }
+
+    def report(self) -> None:
+        summary = self.summary()
+        if not summary["activities"]:
+            return
+        print(
+            f"Prompt compaction: ~{summary['tokens_saved_per_activity']:.0f} input "
+            f"tokens saved per activity "
+            f"({summary['tokens_after']}/{summary['tokens_before']} total)"
+        )
@@ -0,0 +1,116 @@
+"""
+Per-item retry policy for LM classification calls.
+
+Errors are sorted into classes with their own retry budgets: rate limits and
+timeouts are retried generously with exponential backoff and full jitter,
+parse failures a couple of times (a resample often parses), and permanent
+errors (bad input, auth, unsupported requests) not at all, so one hopeless
+activity never burns calls a transient one could use.
+"""
+
+import asyncio
+import random
+from typing import Dict
+
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+SERVER_ERROR = "server_error"
+PARSE_FAILURE = "parse_failure"
+PERMANENT = "permanent"
+
+DEFAULT_RETRY_BUDGETS = {
+    RATE_LIMIT: 8,
+    TIMEOUT: 4,
+    SERVER_ERROR: 4,
+    PARSE_FAILURE: 2,
+    PERMANENT: 0,
+}
+
+# Checked in this order against "<ExceptionType> <message>", lowercased
+ERROR_MARKERS = [
+    (
+        RATE_LIMIT,
+        [
+            "ratelimit",
+            "rate limit",
+            "429",
+            "quota",
+            "resource exhausted",
+            "resource_exhausted",
+            "too many requests",
+        ],
+    ),
+    (TIMEOUT, ["timeout", "timed out", "deadline exceeded"]),
+    (
+        SERVER_ERROR,
+        [
+            "internalservererror",
+            "serviceunavailable",
+            "apiconnectionerror",
+            "500",
+            "502",
+            "503",
+            "504",
+            "overloaded",
+            "connection",
+        ],
+    ),
+    (
+        PARSE_FAILURE,
+        [
+            "failed to parse",
+            "adapterparseerror",
+            "jsondecodeerror",
+            "validationerror",
+            "invalid result format",
+            "expected to find",
+        ],
+    ),
+]
+
+
+class ClassificationError(Exception):
+    """A failed classification attempt, tagged with its error class."""
+
+    def __init__(self, message, error_class: str = None):
+        if isinstance(message, Exception):
+            error_class = error_class or classify_error(message)
+        super().__init__(f"Classification failed: {message}")
+        self.error_class = error_class or PERMANENT
+
+
+def classify_error(error: Exception) -> str:
+    """Error class of an exception raised by an LM call or its parsing."""
+    if isinstance(error, ClassificationError):
+        return error.error_class
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return TIMEOUT
+    text = f"{type(error).__name__} {error}".lower()
+    for error_class, markers in ERROR_MARKERS:
+        if any(marker in text for marker in markers):
+            return error_class
+    return PERMANENT
+
+
+class RetryPolicy:
+    """Per-class retry budgets with capped exponential backoff and full jitter."""
+
+    def __init__(
+        self,
+        budgets: Dict[str, int] = None,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.budgets = {**DEFAULT_RETRY_BUDGETS, **(budgets or {})}
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error_class: str, attempt: int) -> bool:
+        """Whether failure number `attempt` (1-based) of this class is retried."""
+        return attempt <= self.budgets.get(error_class, 0)
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before retry number `attempt` (1-based)."""
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        )
@@ -0,0 +1,167 @@
+"""
+Sharded batch classification.
+
+Activities are split deterministically by a hash of their unique_id into N
+shards. Each shard runs label_all_activities_async on its own (in another
+process or on another machine) with its own output directory, checkpoint
+store and prediction cache under <output_dir>/shards/. merge_shards then folds
+the shard outputs into one classified_results.json, flagging any unique_id
+that was labeled differently by more than one shard.
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Dict, List
+
+from lib.dspy_batch_classify import label_all_activities_async
+from lib.dspy_checkpoint import CheckpointStore
+from lib.dspy_classifier import LLM_FIELDS
+from lib.dspy_prediction_cache import PredictionCache, program_fingerprint
+from lib.util_file import read_json_records, write_json_atomic
+
+
+def shard_index(unique_id: str, num_shards: int) -> int:
+    """Stable shard for a unique_id (independent of PYTHONHASHSEED)."""
+    digest = hashlib.sha256(str(unique_id).encode()).hexdigest()
+    return int(digest[:16], 16) % num_shards
+
+
+def select_shard(activities: List[Dict], shard: int, num_shards: int) -> List[Dict]:
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"shard must be in [0, {num_shards}), got {shard}")
+    return [
+        a for a in activities if shard_index(a.get("unique_id"), num_shards) == shard
+    ]
+
+
+def shard_output_dir(output_dir, shard: int, num_shards: int) -> Path:
+    return Path(output_dir) / "shards" / f"shard-{shard:03d}-of-{num_shards:03d}"
+
+
+async def classify_shard(
+    model,
+    activities: List[Dict],
+    output_dir,
+    shard: int,
+    num_shards: int,
+    use_cache: bool = True,
+    **kwargs,
+) -> Path:
+    """
+    Classify one shard into its own directory with its own checkpoint store.
+
+    Extra keyword arguments are passed to label_all_activities_async.
+    """
+    shard_dir = shard_output_dir(output_dir, shard, num_shards)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    subset = select_shard(activities, shard, num_shards)
+    print(f"Shard {shard + 1}/{num_shards}: {len(subset)}/{len(activities)} activities")
+
+    fingerprint = program_fingerprint(model)
+    checkpoint_store = CheckpointStore(fingerprint, shard_dir / "progress.sqlite")
+    # One cache file per shard so processes never contend for a SQLite writer
+    cache = (
+        PredictionCache(fingerprint, shard_dir / "prediction_cache.sqlite")
+        if use_cache
+        else None
+    )
+    try:
+        await label_all_activities_async(
+            model,
+            subset,
+            output_dir=str(shard_dir),
+            cache=cache,
+            checkpoint_store=checkpoint_store,
+            **kwargs,
+        )
+    finally:
+        checkpoint_store.close()
+        if cache is not None:
+            cache.close()
+    return shard_dir
+
+
+def merge_shards(output_dir, num_shards: int) -> Dict:
+    """
+    Merge shard outputs into <output_dir>/classified_results.json.
+
+    Records still in a shard's uncompacted JSON Lines log are included and the
+    shard is reported as incomplete. A unique_id reported by more than one
+    shard with different labels is a conflict: the most recently classified
+    record is kept and every version is written to merge_conflicts.json.
+    Identical repeats are dropped silently.
+    """
+    output_dir = Path(output_dir)
+    merged = {}
+    sources = {}
+    conflicts = []
+    errors = []
+    missing = []
+    incomplete = []
+    misplaced = 0
+
+    for shard in range(num_shards):
+        shard_dir = shard_output_dir(output_dir, shard, num_shards)
+        results_path = shard_dir / "classified_results.json"
+        # An interrupted shard leaves records in the JSON Lines log that were
+        # never compacted into the JSON file
+        results_log = results_path.with_suffix(".jsonl")
+        if not results_path.exists() and not results_log.exists():
+            missing.append(shard)
+            continue
+        if (shard_dir / "unclassified.json").exists() or results_log.exists():
+            incomplete.append(shard)
+        errors.extend(read_json_records(str(shard_dir / "errors.json")))
+
+        for record in read_json_records(str(results_path)):
+            unique_id = record.get("unique_id")
+            misplaced += shard_index(unique_id, num_shards) != shard
+            if unique_id not in merged:
+                merged[unique_id] = record
+                sources[unique_id] = shard
+                continue
+
+            kept = merged[unique_id]
+            if all(kept.get(f) == record.get(f) for f in LLM_FIELDS):
+                continue
+            conflicts.append(
+                {
+                    "unique_id": unique_id,
+                    "shards": [sources[unique_id], shard],
+                    "labels": [
+                        {f: kept.get(f) for f in LLM_FIELDS},
+                        {f: record.get(f) for f in LLM_FIELDS},
+                    ],
+                }
+            )
+            if record.get("classified_at", "") > kept.get("classified_at", ""):
+                merged[unique_id] = record
+                sources[unique_id] = shard
+
+    write_json_atomic(
+        list(merged.values()), str(output_dir / "classified_results.json")
+    )
+    if errors:
+        write_json_atomic(errors, str(output_dir / "errors.json"))
+    if conflicts:
+        write_json_atomic(conflicts, str(output_dir / "merge_conflicts.json"))
+
+    summary = {
+        "shards": num_shards,
+        "records": len(merged),
+        "conflicts": len(conflicts),
+        "misplaced": misplaced,
+        "missing_shards": missing,
+        "incomplete_shards": incomplete,
+    }
+    print(
+        f"Merged {summary['records']} records from {num_shards - len(missing)}/"
+        f"{num_shards} shards, {summary['conflicts']} conflicts"
+    )
+    if missing:
+        print(f"WARNING: no results for shards {missing}")
+    if incomplete:
+        print(f"WARNING: shards {incomplete} did not finish cleanly")
+    if misplaced:
+        print(f"WARNING: {misplaced} records found outside their hash shard")
+    return summary
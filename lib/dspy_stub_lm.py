@@ -0,0 +1,195 @@
+"""
+Deterministic stub LM for offline load testing of the classifier pipeline.
+
+StubLM plugs into dspy.configure like any other LM but never leaves the
+process. Outputs are schema-valid IATIClassifier labels derived from a hash of
+the request, so the same activity always gets the same labels; latency, 429s,
+server errors and malformed responses are injected from a seeded random
+stream so a run is reproducible end to end.
+
+    dspy.configure(lm=StubLM(latency_median=0.5, rate_limit_rate=0.02))
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import typing
+from collections import Counter
+
+import dspy
+from litellm import InternalServerError, ModelResponse, RateLimitError
+
+from lib.dspy_classifier import IATIClassifier
+
+LOCATIONS = ["Amman", "Irbid", "Zarqa", "Mafraq", "Karak", "Ma'an", "Jordan"]
+ORGANISATIONS = ["UNHCR", "UNICEF", "UNRWA", "WFP", "GIZ", "USAID", "EU", "NRC"]
+STRING_POOLS = {
+    "llm_geographic_focus": LOCATIONS,
+    "llm_funding_org": ORGANISATIONS,
+    "llm_implementing_org": ORGANISATIONS,
+}
+ACTIVITIES_PATTERN = re.compile(r"\[\[ ## activities ## \]\]\n(.*?)\n\n", re.DOTALL)
+
+
+def _literal_values(annotation):
+    """Allowed values of List[Literal[...]], or None for free-text lists."""
+    (item_type,) = typing.get_args(annotation) or (None,)
+    if typing.get_origin(item_type) is typing.Literal:
+        return list(typing.get_args(item_type))
+    return None
+
+
+def stub_labels(text: str, signature=IATIClassifier) -> dict:
+    """Schema-valid labels for `text`, stable across calls and processes."""
+    rng = random.Random(hashlib.sha256(text.encode()).digest())
+    labels = {}
+    for name, field in signature.output_fields.items():
+        pool = _literal_values(field.annotation) or STRING_POOLS.get(name, [])
+        labels[name] = rng.sample(pool, rng.randint(0, min(2, len(pool))))
+    return labels
+
+
+class StubLM(dspy.LM):
+    """
+    Offline LM returning IATIClassifier-shaped outputs.
+
+    Args:
+        latency_median: Median seconds per call (lognormal)
+        latency_sigma: Lognormal shape; 0 for constant latency
+        rate_limit_rate: Share of calls raising a 429 RateLimitError
+        error_rate: Share of calls raising a 500 InternalServerError
+        malformed_rate: Share of calls returning truncated, unparseable output
+        capacity: Concurrent calls above this raise 429, like a provider quota
+        seed: Seed for the fault and latency stream
+    """
+
+    def __init__(
+        self,
+        model: str = "stub/iati-classifier",
+        latency_median: float = 0.5,
+        latency_sigma: float = 0.4,
+        rate_limit_rate: float = 0.0,
+        error_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        capacity: int = None,
+        seed: int = 0,
+        signature=IATIClassifier,
+    ):
+        # Subclass dspy.LM rather than BaseLM so DSPy's LM callbacks fire
+        super().__init__(model=model, cache=False)
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.capacity = capacity
+        self.signature = signature
+        self.stats = Counter()
+        self.in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _plan(self):
+        """Draw (latency, fault) for the next call from the seeded stream."""
+        with self._lock:
+            latency = self.latency_median * self._rng.lognormvariate(
+                0, self.latency_sigma
+            )
+            roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            return latency, "rate_limit"
+        roll -= self.rate_limit_rate
+        if roll < self.error_rate:
+            return latency, "error"
+        roll -= self.error_rate
+        if roll < self.malformed_rate:
+            return latency, "malformed"
+        return latency, None
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.stats["calls"] += 1
+            return self.capacity is not None and self.in_flight > self.capacity
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _respond(self, messages, fault, over_capacity):
+        if over_capacity or fault == "rate_limit":
+            self.stats["rate_limited"] += 1
+            raise RateLimitError("429 stub rate limit", "stub", self.model)
+        if fault == "error":
+            self.stats["errors"] += 1
+            raise InternalServerError("500 stub server error", "stub", self.model)
+
+        system = messages[0]["content"] if messages else ""
+        request = messages[-1]["content"] if messages else ""
+        content = self._content(system, request)
+        if fault == "malformed":
+            self.stats["malformed"] += 1
+            content = content[: len(content) // 3]
+
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in messages or [])
+        return ModelResponse(
+            choices=[
+                {
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            model=self.model,
+            usage={
+                "prompt_tokens": prompt_chars // 4,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": (prompt_chars + len(content)) // 4,
+            },
+        )
+
+    def _content(self, system: str, request: str) -> str:
+        outputs = {}
+        if "classifications" in system:
+            match = ACTIVITIES_PATTERN.search(request + "\n\n")
+            activities = json.loads(match.group(1)) if match else []
+            outputs["classifications"] = [
+                {"index": a.get("index"), **stub_labels(json.dumps(a), self.signature)}
+                for a in activities
+            ]
+        else:
+            if "reasoning" in system:
+                outputs["reasoning"] = "Stub reasoning."
+            labels = stub_labels(request, self.signature)
+            outputs.update({k: v for k, v in labels.items() if k in system})
+
+        if "[[ ## completed ## ]]" not in system:
+            return json.dumps(outputs)
+        sections = [
+            f"[[ ## {name} ## ]]\n{value if isinstance(value, str) else json.dumps(value)}"
+            for name, value in outputs.items()
+        ]
+        return "\n\n".join(sections + ["[[ ## completed ## ]]"])
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt}]
+        latency, fault = self._plan()
+        over_capacity = self._enter()
+        try:
+            time.sleep(latency)
+            return self._respond(messages, fault, over_capacity)
+        finally:
+            self._exit()
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt}]
+        latency, fault = self._plan()
+        over_capacity = self._enter()
+        try:
+            await asyncio.sleep(latency)
+            return self._respond(messages, fault, over_capacity)
+        finally:
+            self._exit()
@@ -0,0 +1,305 @@
+"""
+Per-call telemetry for batch classification.
+
+RunTelemetry records latency, retries and errors for every classifier call
+and time spent waiting for concurrency slots and writing checkpoints.
+TelemetryCallback adds input/output tokens and cost for every underlying LM
+request. summary() aggregates them into histograms and percentiles, which are
+written as a run summary JSON and optionally as a Prometheus textfile for
+node_exporter's textfile collector.
+
+DSPy's track_usage context is thread-local rather than task-local, so it
+cannot attribute usage between concurrent asyncio tasks; the callback reads
+each request's own history entry instead.
+"""
+
+import math
+import os
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from dspy.utils.callback import BaseCallback
+
+from lib.dspy_retry import classify_error
+from lib.util_file import write_json_atomic
+
+LATENCY_BUCKETS = [0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, math.inf]
+TOKEN_BUCKETS = [250, 500, 1000, 2000, 4000, 8000, 16000, 32000, math.inf]
+
+
+class Histogram:
+    """Cumulative-bucket histogram that also keeps samples for percentiles."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.samples: List[float] = []
+
+    def observe(self, value: float) -> None:
+        self.samples.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def bucket_counts(self) -> Dict[str, int]:
+        return {
+            _bucket_label(bound): sum(1 for v in self.samples if v <= bound)
+            for bound in self.buckets
+        }
+
+    def summary(self) -> Dict:
+        count = len(self.samples)
+        return {
+            "count": count,
+            "sum": sum(self.samples),
+            "mean": sum(self.samples) / count if count else None,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": max(self.samples) if count else None,
+            "buckets": self.bucket_counts(),
+        }
+
+
+def _bucket_label(bound: float) -> str:
+    return "+Inf" if bound == math.inf else f"{bound:g}"
+
+
+def estimate_cost(model: str, usage: Dict) -> Optional[float]:
+    """USD cost from litellm's price map, or None for unmapped models."""
+    try:
+        from litellm import cost_per_token
+
+        prompt_cost, completion_cost = cost_per_token(
+            model=model,
+            prompt_tokens=usage.get("prompt_tokens") or 0,
+            completion_tokens=usage.get("completion_tokens") or 0,
+        )
+    except Exception:
+        return None
+    return prompt_cost + completion_cost
+
+
+class TelemetryCallback(BaseCallback):
+    """Feed token usage and cost of every LM request into a RunTelemetry."""
+
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+        self._lms = {}
+
+    def on_lm_start(self, call_id, instance, inputs):
+        self._lms[call_id] = instance
+
+    def on_lm_end(self, call_id, outputs, exception=None):
+        lm = self._lms.pop(call_id, None)
+        # The entry is appended just before this runs, with no await in between
+        if lm is None or exception is not None or not getattr(lm, "history", None):
+            return
+        self.telemetry.record_lm_request(lm.history[-1])
+
+
+class RunTelemetry:
+    """Collect per-call measurements over one labeling run."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.input_tokens = Histogram(TOKEN_BUCKETS)
+        self.output_tokens = Histogram(TOKEN_BUCKETS)
+        self.stage_seconds = Counter()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.cost = 0.0
+        self.cost_known = True
+        self.lm_requests = 0
+        self.lm_cache_hits = 0
+        self.by_model = defaultdict(
+            lambda: {"requests": 0, "tokens": 0, "cost_usd": 0.0}
+        )
+        self.cache_hits = 0
+        self.retries = 0
+        self.retries_by_class = Counter()
+        self.failures_by_class = Counter()
+        self.completed = 0
+        self.failed = 0
+        self.deferred = 0
+        self.priority_coverage = None
+
+    def record_call(self, kind: str, latency: float, error: Exception = None) -> None:
+        """One classifier call of `kind` ("full", "light", "packed", ...)."""
+        self.calls[kind] += 1
+        self.latency[kind].observe(latency)
+        self.stage_seconds["lm_call"] += latency
+        if error is not None:
+            self.errors[classify_error(error)] += 1
+
+    def record_retry(self, error_class: str) -> None:
+        self.retries += 1
+        self.retries_by_class[error_class] += 1
+
+    def record_failure(self, error_class: str, count: int = 1) -> None:
+        """Activities given up on after exhausting their `error_class` budget."""
+        self.failures_by_class[error_class] += count
+
+    def record_lm_request(self, entry: Dict) -> None:
+        """Tokens and cost from one DSPy LM history entry."""
+        self.lm_requests += 1
+        usage = entry.get("usage") or {}
+        if not usage:
+            # Served from DSPy's LM cache
+            self.lm_cache_hits += 1
+            return
+        self.input_tokens.observe(usage.get("prompt_tokens") or 0)
+        self.output_tokens.observe(usage.get("completion_tokens") or 0)
+        cost = entry.get("cost")
+        if cost is None:
+            cost = estimate_cost(entry.get("model"), usage)
+
+        model = self.by_model[entry.get("model")]
+        model["requests"] += 1
+        model["tokens"] += (usage.get("prompt_tokens") or 0) + (
+            usage.get("completion_tokens") or 0
+        )
+        if cost is None:
+            self.cost_known = False
+            model["cost_usd"] = None
+        else:
+            self.cost += cost
+            if model["cost_usd"] is not None:
+                model["cost_usd"] += cost
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        self.stage_seconds[stage] += seconds
+
+    def summary(self) -> Dict:
+        elapsed = time.monotonic() - self.started
+        input_total = sum(self.input_tokens.samples)
+        output_total = sum(self.output_tokens.samples)
+        return {
+            "started_at": self.started_at,
+            "elapsed_seconds": elapsed,
+            "completed": self.completed,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "priority_coverage": self.priority_coverage,
+            "throughput_per_minute": self.completed / elapsed * 60 if elapsed else 0.0,
+            "calls": dict(self.calls),
+            "calls_per_minute": (
+                sum(self.calls.values()) / elapsed * 60 if elapsed else 0.0
+            ),
+            "lm_requests": self.lm_requests,
+            "lm_cache_hits": self.lm_cache_hits,
+            "cache_hits": self.cache_hits,
+            "retries": self.retries,
+            "retries_by_class": dict(self.retries_by_class),
+            "failures_by_class": dict(self.failures_by_class),
+            "errors": dict(self.errors),
+            "latency_seconds": {k: h.summary() for k, h in self.latency.items()},
+            "input_tokens": self.input_tokens.summary(),
+            "output_tokens": self.output_tokens.summary(),
+            "tokens_per_activity": (
+                (input_total + output_total) / self.completed
+                if self.completed
+                else None
+            ),
+            "estimated_cost_usd": self.cost if self.cost_known else None,
+            "by_model": {str(k): dict(v) for k, v in self.by_model.items()},
+            "stage_seconds": dict(self.stage_seconds),
+        }
+
+    def write_summary(self, path: str) -> Dict:
+        summary = self.summary()
+        write_json_atomic(summary, str(path))
+        return summary
+
+    def write_prometheus(self, path: str, prefix: str = "iati_classify") -> None:
+        """Write metrics in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            # One TYPE line per metric family, however many label sets follow
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        def metric(name, kind, samples):
+            declare(name, kind)
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{prefix}_{name}{label_text} {value}")
+
+        def histogram(name, hist, labels=None):
+            labels = labels or {}
+            declare(name, "histogram")
+            label_text = "".join(f'{k}="{v}",' for k, v in labels.items())
+            for le, count in hist.bucket_counts().items():
+                lines.append(f'{prefix}_{name}_bucket{{{label_text}le="{le}"}} {count}')
+            plain = f"{{{label_text.rstrip(',')}}}" if labels else ""
+            lines.append(f"{prefix}_{name}_sum{plain} {sum(hist.samples)}")
+            lines.append(f"{prefix}_{name}_count{plain} {len(hist.samples)}")
+
+        metric("activities_completed_total", "counter", [({}, self.completed)])
+        metric("activities_failed_total", "counter", [({}, self.failed)])
+        metric("activities_deferred_total", "counter", [({}, self.deferred)])
+        metric("cache_hits_total", "counter", [({}, self.cache_hits)])
+        metric(
+            "retries_total",
+            "counter",
+            [({"class": k}, v) for k, v in self.retries_by_class.items()],
+        )
+        metric(
+            "failures_total",
+            "counter",
+            [({"class": k}, v) for k, v in self.failures_by_class.items()],
+        )
+        metric(
+            "calls_total", "counter", [({"kind": k}, v) for k, v in self.calls.items()]
+        )
+        metric(
+            "errors_total",
+            "counter",
+            [({"class": k}, v) for k, v in self.errors.items()],
+        )
+        metric(
+            "stage_seconds_total",
+            "counter",
+            [({"stage": k}, v) for k, v in self.stage_seconds.items()],
+        )
+        metric(
+            "throughput_per_minute", "gauge", [({}, summary["throughput_per_minute"])]
+        )
+        if summary["estimated_cost_usd"] is not None:
+            metric("cost_usd_total", "counter", [({}, summary["estimated_cost_usd"])])
+        for kind, hist in self.latency.items():
+            histogram("call_latency_seconds", hist, {"kind": kind})
+        histogram("input_tokens", self.input_tokens)
+        histogram("output_tokens", self.output_tokens)
+
+        # Write-then-rename so the collector never reads a partial file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    def report(self) -> None:
+        summary = self.summary()
+        latency = Histogram(LATENCY_BUCKETS)
+        for hist in self.latency.values():
+            latency.samples.extend(hist.samples)
+        tokens = summary["tokens_per_activity"]
+        print(
+            f"Telemetry: {summary['completed']} activities in "
+            f"{summary['elapsed_seconds']:.1f}s "
+            f"({summary['throughput_per_minute']:.1f}/min), "
+            f"{sum(self.calls.values())} LM calls, "
+            f"latency p50 {latency.percentile(0.5) or 0:.2f}s "
+            f"p90 {latency.percentile(0.9) or 0:.2f}s, "
+            f"{tokens or 0:.0f} tokens/activity"
+        )
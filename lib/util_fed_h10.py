@@ -0,0 +1,102 @@
+"""
+Parser and binary cache for Federal Reserve H.10 exchange rate downloads.
+
+The H.10 "seriescolumn" CSV has six header rows (series description, unit,
+multiplier, currency, unique identifier, time period) followed by one row per
+business day, with "ND" marking days without an observation.
+"""
+
+import csv
+import hashlib
+import os
+import pickle
+
+import pandas as pd
+
+H10_HEADER_ROWS = 6
+
+
+def read_h10_metadata(path: str) -> dict:
+    """
+    Read the series metadata from the H.10 header rows.
+
+    Returns:
+        dict: currency -> {'description', 'unit', 'multiplier', 'series_id',
+        'usd_per_forex'}. '$US' in the series id marks rates quoted as USD per
+        unit of foreign currency; all others are foreign currency per USD.
+    """
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        header = [row for _, row in zip(range(H10_HEADER_ROWS), csv.reader(f))]
+
+    rows = {row[0].strip(): row[1:] for row in header}
+    metadata = {}
+    for i, currency in enumerate(rows["Currency:"]):
+        series_id = rows["Unique Identifier:"][i]
+        metadata[currency] = {
+            "description": header[0][i + 1],
+            "unit": rows["Unit:"][i],
+            "multiplier": float(rows["Multiplier:"][i]),
+            "series_id": series_id,
+            "usd_per_forex": "$US" in series_id,
+        }
+    return metadata
+
+
+def parse_h10_csv(path: str):
+    """
+    Parse an H.10 CSV into a float rate table indexed by date.
+
+    The numeric block is read in a single typed pass with "ND" as missing.
+
+    Returns:
+        tuple: (rates DataFrame, metadata dict from read_h10_metadata)
+    """
+    metadata = read_h10_metadata(path)
+    currencies = list(metadata)
+
+    rates = pd.read_csv(
+        path,
+        skiprows=H10_HEADER_ROWS,
+        header=None,
+        names=["date"] + currencies,
+        index_col="date",
+        parse_dates=["date"],
+        na_values=["ND"],
+        dtype={currency: "float64" for currency in currencies},
+    )
+    rates.columns.name = None
+
+    for currency, meta in metadata.items():
+        if meta["multiplier"] != 1:
+            rates[currency] = rates[currency] * meta["multiplier"]
+
+    return rates, metadata
+
+
+def file_fingerprint(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_h10_cache(cache_path: str, source_fingerprint: str):
+    """Return the cached payload if it was built from the same source file."""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, "rb") as f:
+            payload = pickle.load(f)
+    except Exception as e:
+        print(f"Ignoring unreadable exchange rate cache {cache_path}: {e}")
+        return None
+
+    if payload.get("source_fingerprint") != source_fingerprint:
+        return None
+    return payload
+
+
+def write_h10_cache(cache_path: str, payload: dict) -> None:
+    """Write the cache atomically so an interrupted write is never read back."""
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
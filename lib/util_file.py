@@ -19,6 +19,37 @@ def read_json(path: str) -> Dict:
     return json.load(open(path, "r"))
 
 
+def read_jsonl(path: str) -> List[Dict]:
+    """Read a JSON Lines file, skipping a truncated final line from a crash."""
+    records = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def read_json_records(path: str) -> List[Dict]:
+    """
+    Read a list of records from a .json or .jsonl file.
+
+    For `x.json`, records still sitting in an uncompacted `x.jsonl` next to it
+    are appended, so interrupted runs read back completely.
+    """
+    records = []
+    if path.endswith(".jsonl"):
+        return read_jsonl(path) if os.path.exists(path) else records
+
+    if os.path.exists(path):
+        records.extend(read_json(path))
+    jsonl_path = os.path.splitext(path)[0] + ".jsonl"
+    if os.path.exists(jsonl_path):
+        records.extend(read_jsonl(jsonl_path))
+    return records
+
+
 """
 Write Functions
 """
@@ -36,3 +67,29 @@ def write_csv(data: Any, header: Any, filename: str) -> None:
 def write_json(data: Any, filename: str, serializer=datetime_serializer) -> None:
     with open(filename, "w", newline="") as file:
         json.dump(data, file, indent=4, ensure_ascii=False, default=serializer)
+
+
+def write_json_atomic(data: Any, filename: str, serializer=datetime_serializer) -> None:
+    """Write JSON to a temporary file and rename it over `filename`."""
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "w", newline="") as file:
+        json.dump(data, file, indent=4, ensure_ascii=False, default=serializer)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def append_jsonl(
+    records: List[Any],
+    filename: str,
+    serializer=datetime_serializer,
+    fsync: bool = False,
+) -> None:
+    """Append records to a JSON Lines file, one object per line."""
+    with open(filename, "a", encoding="utf-8") as file:
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False, default=serializer))
+            file.write("\n")
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
@@ -3,24 +3,62 @@ import pandas as pd
 import numpy as np
 
 from definitions import ROOT_DIR, JOD_PEGGED_USD, SAR_PEGGED_USD
-
-
-def load_and_prepare_exchange_rates():
+from lib.util_fed_h10 import (
+    file_fingerprint,
+    parse_h10_csv,
+    read_h10_cache,
+    write_h10_cache,
+)
+
+FED_XR_PATH = os.path.join(ROOT_DIR, "data", "xr", "fed_xr_2010_2025.csv")
+FED_XR_CACHE_PATH = os.path.join(ROOT_DIR, "data", "xr", "fed_xr_2010_2025.pkl")
+
+# nearest: closest rate in either direction (original behaviour)
+# previous: most recent rate on or before the transaction date (previous business day)
+# interpolate: linear interpolation between surrounding rates
+# monthly_average / annual_average: mean rate over the transaction's month / year
+XR_MATCHING_POLICIES = [
+    "nearest",
+    "previous",
+    "interpolate",
+    "monthly_average",
+    "annual_average",
+]
+
+
+def load_and_prepare_exchange_rates(use_cache: bool = True):
     """Load Federal Reserve exchange rate data and prepare it for use."""
-    xr = pd.read_csv(os.path.join(ROOT_DIR, "data", "xr", "fed_xr_2010_2025.csv"))
+    payload = _load_h10_payload(use_cache)
+    return payload["xr"].copy(), dict(payload["conversion_directions"])
+
 
-    conversion_directions = dict(zip(xr.iloc[2], xr.iloc[3]))
-    conversion_directions.pop("Currency:", None)
+def load_standardized_exchange_rates(use_cache: bool = True):
+    """Load the Fed exchange rates already converted to usd_per_forex."""
+    return _load_h10_payload(use_cache)["standardized_xr"].copy()
 
-    xr.columns = xr.iloc[2]
-    xr = xr[5:].copy()
-    xr["date"] = pd.to_datetime(xr["Currency:"])
-    xr = xr.set_index("date").drop(columns=["Currency:"])
 
-    for col in xr.columns:
-        xr[col] = pd.to_numeric(xr[col], errors="coerce")
+def _load_h10_payload(use_cache: bool = True):
+    """Parse the Fed H.10 CSV once and keep the result in a binary cache."""
+    source_fingerprint = file_fingerprint(FED_XR_PATH)
+    if use_cache:
+        payload = read_h10_cache(FED_XR_CACHE_PATH, source_fingerprint)
+        if payload is not None:
+            return payload
 
-    return xr, conversion_directions
+    xr, metadata = parse_h10_csv(FED_XR_PATH)
+    conversion_directions = {
+        currency: meta["series_id"] for currency, meta in metadata.items()
+    }
+    payload = {
+        "source_fingerprint": source_fingerprint,
+        "xr": xr,
+        "conversion_directions": conversion_directions,
+        "metadata": metadata,
+        "standardized_xr": standardize_xr_data_usd_per_forex(xr, conversion_directions),
+    }
+    if use_cache:
+        write_h10_cache(FED_XR_CACHE_PATH, payload)
+    return payload
 
 
 def standardize_xr_data_usd_per_forex(xr_df, conversion_directions):
@@ -84,46 +122,122 @@ def create_special_currency_rates():
     return special_rates
 
 
-def find_exchange_rates_for_currency(tf_prepared, currency_data, special_rates):
-    """Find exchange rates for all transactions using nearest date matching."""
+def get_rate_series(currency, currency_data, special_rates):
+    """Return sorted (dates, rates) arrays of usd_per_forex rates for a currency."""
+    if currency in special_rates:
+        rate_data = special_rates[currency]["rate"]
+    elif currency in currency_data.columns:
+        rate_data = currency_data[currency]
+    else:
+        return None
+
+    rate_data = rate_data.dropna().sort_index()
+    rate_dates = pd.to_datetime(rate_data.index).values.astype("datetime64[ns]")
+    return rate_dates, rate_data.values.astype(float)
+
+
+def _period_average_rates(trans_dates, rate_dates, rate_values, unit):
+    """Average rates per calendar period ("M" or "Y") and map them onto transactions."""
+    rate_periods = rate_dates.astype(f"datetime64[{unit}]")
+    periods, inverse = np.unique(rate_periods, return_inverse=True)
+    averages = np.bincount(inverse, weights=rate_values) / np.bincount(inverse)
+
+    trans_periods = trans_dates.astype(f"datetime64[{unit}]")
+    idx = np.clip(np.searchsorted(periods, trans_periods), 0, len(periods) - 1)
+    return np.where(periods[idx] == trans_periods, averages[idx], np.nan)
+
+
+def match_rates(trans_dates, rate_dates, rate_values, policy="nearest"):
+    """
+    Vectorized exchange rate lookup for an array of transaction dates.
+
+    Args:
+        trans_dates: datetime64 array of transaction dates (NaT allowed)
+        rate_dates: sorted datetime64 array of rate observation dates
+        rate_values: rates aligned with rate_dates
+        policy: One of XR_MATCHING_POLICIES
+
+    Returns:
+        np.ndarray: Matched rate per transaction, NaN where no rate applies.
+        Period averages are NaN when the transaction's month/year has no observations.
+    """
+    trans_dates = np.asarray(trans_dates, dtype="datetime64[ns]")
+    rates = np.full(len(trans_dates), np.nan)
+    valid = ~np.isnat(trans_dates)
+    if len(rate_dates) == 0 or not valid.any():
+        return rates
+
+    dates = trans_dates[valid]
+    last = len(rate_dates) - 1
+
+    if policy == "nearest":
+        right = np.clip(np.searchsorted(rate_dates, dates), 0, last)
+        left = np.clip(right - 1, 0, last)
+        left_diff = np.abs(dates - rate_dates[left])
+        right_diff = np.abs(rate_dates[right] - dates)
+        # Ties go to the earlier rate, as the original argmin search did
+        matched = np.where(left_diff <= right_diff, left, right)
+        rates[valid] = rate_values[matched]
+    elif policy == "previous":
+        matched = np.searchsorted(rate_dates, dates, side="right") - 1
+        rates[valid] = np.where(
+            matched >= 0, rate_values[np.clip(matched, 0, last)], np.nan
+        )
+    elif policy == "interpolate":
+        rates[valid] = np.interp(
+            dates.astype(np.int64), rate_dates.astype(np.int64), rate_values
+        )
+    elif policy == "monthly_average":
+        rates[valid] = _period_average_rates(dates, rate_dates, rate_values, "M")
+    elif policy == "annual_average":
+        rates[valid] = _period_average_rates(dates, rate_dates, rate_values, "Y")
+    else:
+        raise ValueError(
+            f"Unknown matching policy {policy}. Choose from {XR_MATCHING_POLICIES}"
+        )
+
+    return rates
+
+
+def find_exchange_rates_for_currency(
+    tf_prepared, currency_data, special_rates, policies=None
+):
+    """
+    Find exchange rates for all transactions in a single pass per currency.
+
+    `exchange_rate` always holds the nearest date match. Each policy in
+    `policies` adds a parallel `exchange_rate_<policy>` column.
+    """
     tf_with_rates = tf_prepared.copy()
-    tf_with_rates["exchange_rate"] = np.nan
-    unique_currencies = tf_with_rates["currency"].dropna().unique()
+    policies = policies or []
+    all_policies = ["nearest"] + [p for p in policies if p != "nearest"]
 
-    for currency in unique_currencies:
-        currency_mask = tf_with_rates["currency"] == currency
+    currencies = tf_with_rates["currency"].values
+    trans_dates = pd.to_datetime(tf_with_rates["date"]).values.astype("datetime64[ns]")
+    rates = {policy: np.full(len(tf_with_rates), np.nan) for policy in all_policies}
 
-        if currency == "USD":
-            tf_with_rates.loc[currency_mask, "exchange_rate"] = 1.0
-            continue
+    for currency in tf_with_rates["currency"].dropna().unique():
+        currency_mask = currencies == currency
 
-        currency_transactions = tf_with_rates[currency_mask].copy()
-        if len(currency_transactions) == 0:
+        if currency == "USD":
+            for policy in all_policies:
+                rates[policy][currency_mask] = 1.0
             continue
 
-        if currency in special_rates:
-            rate_data = special_rates[currency].reset_index()
-        elif currency in currency_data.columns:
-            rate_data = currency_data[[currency]].dropna().reset_index()
-            rate_data = rate_data.rename(columns={currency: "rate"})
-        else:
+        rate_series = get_rate_series(currency, currency_data, special_rates)
+        if rate_series is None:
             print(f"Warning: No exchange rate data available for currency {currency}")
             continue
 
-        # Sort and ensure compatible datetime types
-        currency_transactions_sorted = currency_transactions.sort_values("date").copy()
-        rate_data_sorted = rate_data.sort_values("date").copy()
-        currency_transactions_sorted["date"] = pd.to_datetime(
-            currency_transactions_sorted["date"]
-        )
-        rate_data_sorted["date"] = pd.to_datetime(rate_data_sorted["date"])
-
-        merged = manual_nearest_date_merge(
-            currency_transactions_sorted, rate_data_sorted, "date", "rate"
-        )
-        # embed(banner1=f"Merged currency: {currency}")
+        rate_dates, rate_values = rate_series
+        for policy in all_policies:
+            rates[policy][currency_mask] = match_rates(
+                trans_dates[currency_mask], rate_dates, rate_values, policy
+            )
 
-        tf_with_rates.loc[merged.index, "exchange_rate"] = merged["rate"].values
+    tf_with_rates["exchange_rate"] = rates["nearest"]
+    for policy in policies:
+        tf_with_rates[f"exchange_rate_{policy}"] = rates[policy]
 
     return tf_with_rates
 
@@ -131,39 +245,105 @@ def find_exchange_rates_for_currency(tf_prepared, currency_data, special_rates):
 def apply_currency_conversions(tf_with_rates):
     """Apply USD conversions using standardized exchange rates."""
     tf_final = tf_with_rates.copy()
+    is_usd = tf_final["currency"] == "USD"
 
     # foreign_amount * exchange_rate = usd_amount (rates are usd_per_forex)
     tf_final["transaction_value_usd"] = np.where(
-        tf_final["currency"] == "USD",
+        is_usd,
         tf_final["transaction_value"],
         tf_final["transaction_value"] * tf_final["exchange_rate"],
     )
 
+    for policy in XR_MATCHING_POLICIES:
+        rate_col = f"exchange_rate_{policy}"
+        if rate_col in tf_final.columns:
+            tf_final[f"transaction_value_usd_{policy}"] = np.where(
+                is_usd,
+                tf_final["transaction_value"],
+                tf_final["transaction_value"] * tf_final[rate_col],
+            )
+
     return tf_final
 
 
+def summarize_usd_by_policy(tf_final):
+    """Total USD value and unconverted row count under each computed policy."""
+    summary = {}
+    for policy in XR_MATCHING_POLICIES:
+        value_col = f"transaction_value_usd_{policy}"
+        if value_col in tf_final.columns:
+            summary[policy] = {
+                "total_usd": float(tf_final[value_col].sum()),
+                "missing_rates": int(tf_final[value_col].isna().sum()),
+            }
+    return pd.DataFrame.from_dict(summary, orient="index")
+
+
+def build_cross_rates(
+    trans_dates, targets, currency_data, special_rates, policy="nearest"
+):
+    """
+    Precompute usd_per_target rate arrays aligned with the transaction dates.
+
+    Dividing a USD value by the array for a target gives the value in that
+    target currency, so every target is a single vectorized division.
+    """
+    trans_dates = np.asarray(trans_dates, dtype="datetime64[ns]")
+    cross_rates = {}
+
+    for target in targets:
+        if target == "USD":
+            cross_rates[target] = np.ones(len(trans_dates))
+            continue
+
+        rate_series = get_rate_series(target, currency_data, special_rates)
+        if rate_series is None:
+            print(f"Warning: No exchange rate data available for target {target}")
+            continue
+
+        rate_dates, rate_values = rate_series
+        cross_rates[target] = match_rates(trans_dates, rate_dates, rate_values, policy)
+
+    return cross_rates
+
+
+def apply_target_currency_conversions(tf_final, cross_rates):
+    """Add a transaction_value_<target> column per precomputed cross-rate array."""
+    tf_targets = tf_final.copy()
+    usd_values = tf_targets["transaction_value_usd"].values
+
+    for target, usd_per_target in cross_rates.items():
+        # Keep reported values exact when the transaction is already in the target
+        tf_targets[f"transaction_value_{target.lower()}"] = np.where(
+            tf_targets["currency"] == target,
+            tf_targets["transaction_value"],
+            usd_values / usd_per_target,
+        )
+
+    return tf_targets
+
+
 def manual_nearest_date_merge(
     transactions_df, rate_data_df, date_col="date", rate_col="rate"
 ):
-    """Find nearest date for each transaction using manual search."""
+    """Find nearest date for each transaction using a vectorized search."""
     result_df = transactions_df.copy()
-    result_df[rate_col] = np.nan
-
-    rate_dates = pd.to_datetime(rate_data_df[date_col]).values
-    rate_values = rate_data_df[rate_col].values
 
-    for idx, row in transactions_df.iterrows():
-        trans_date = pd.to_datetime(row[date_col]).to_numpy()
-        date_diffs = np.abs(
-            (rate_dates - trans_date).astype("timedelta64[D]").astype(int)
-        )
-        closest_idx = np.argmin(date_diffs)
-        result_df.loc[idx, rate_col] = rate_values[closest_idx]
+    rate_data_sorted = rate_data_df.sort_values(date_col)
+    rate_dates = pd.to_datetime(rate_data_sorted[date_col]).values.astype(
+        "datetime64[ns]"
+    )
+    trans_dates = pd.to_datetime(transactions_df[date_col]).values
+    result_df[rate_col] = match_rates(
+        trans_dates, rate_dates, rate_data_sorted[rate_col].values.astype(float)
+    )
 
     return result_df
 
 
-def spot_check_xr_matching(date, currency, expected_rate=None, tolerance=1e-6):
+def spot_check_xr_matching(
+    date, currency, expected_rate=None, tolerance=1e-6, policy="nearest"
+):
     """
     Verify exchange rate lookup for a specific date/currency combination.
 
@@ -172,6 +352,7 @@ def spot_check_xr_matching(date, currency, expected_rate=None, tolerance=1e-6):
         currency: Currency code (e.g., 'EUR', 'JPY')
         expected_rate: Optional expected rate for validation
         tolerance: Acceptable difference for rate comparison
+        policy: Matching policy to check, one of XR_MATCHING_POLICIES
 
     Returns:
         dict: {'actual_rate': float, 'source': str, 'match': bool}
@@ -182,37 +363,23 @@ def spot_check_xr_matching(date, currency, expected_rate=None, tolerance=1e-6):
         return {"actual_rate": 1.0, "source": "USD", "match": True}
 
     # Load data sources
-    xr_data, conversion_directions = load_and_prepare_exchange_rates()
-    standardized_xr = standardize_xr_data_usd_per_forex(xr_data, conversion_directions)
+    standardized_xr = load_standardized_exchange_rates()
     special_rates = create_special_currency_rates()
 
     actual_rate = None
     source = "Unknown"
 
-    if currency in special_rates:
-        source = f"Special rate ({currency})"
-        rate_data = special_rates[currency].reset_index()
-        temp_df = pd.DataFrame({"date": [date]})
-        merged = pd.merge_asof(
-            temp_df.sort_values("date"),
-            rate_data.sort_values("date"),
-            on="date",
-            direction="nearest",
-        )
-        actual_rate = merged["rate"].iloc[0] if not merged.empty else None
-
-    elif currency in standardized_xr.columns:
-        source = f"Federal Reserve ({currency})"
-        rate_data = standardized_xr[[currency]].dropna().reset_index()
-        rate_data = rate_data.rename(columns={currency: "rate"})
-        temp_df = pd.DataFrame({"date": [date]})
-        merged = pd.merge_asof(
-            temp_df.sort_values("date"),
-            rate_data.sort_values("date"),
-            on="date",
-            direction="nearest",
-        )
-        actual_rate = merged["rate"].iloc[0] if not merged.empty else None
+    rate_series = get_rate_series(currency, standardized_xr, special_rates)
+    if rate_series is not None:
+        if currency in special_rates:
+            source = f"Special rate ({currency})"
+        else:
+            source = f"Federal Reserve ({currency})"
+        rate_dates, rate_values = rate_series
+        matched = match_rates(
+            np.array([date.to_datetime64()]), rate_dates, rate_values, policy
+        )[0]
+        actual_rate = None if np.isnan(matched) else float(matched)
 
     match = False
     if expected_rate is not None and actual_rate is not None:
@@ -221,15 +388,46 @@ def spot_check_xr_matching(date, currency, expected_rate=None, tolerance=1e-6):
     return {"actual_rate": actual_rate, "source": source, "match": match}
 
 
-def convert_all_to_usd(tf: pd.DataFrame):
-    """Convert all transaction values to USD using vectorized operations."""
-    xr_data, conversion_directions = load_and_prepare_exchange_rates()
-    standardized_xr = standardize_xr_data_usd_per_forex(xr_data, conversion_directions)
+def convert_all_to_usd(tf: pd.DataFrame, policies=None):
+    """
+    Convert all transaction values to USD using vectorized operations.
+
+    Pass `policies` (see XR_MATCHING_POLICIES) to also emit
+    `exchange_rate_<policy>` and `transaction_value_usd_<policy>` columns
+    from the same pass.
+    """
+    standardized_xr = load_standardized_exchange_rates()
     tf_prepared = prepare_transaction_dates(tf)
     special_rates = create_special_currency_rates()
     tf_with_rates = find_exchange_rates_for_currency(
-        tf_prepared, standardized_xr, special_rates
+        tf_prepared, standardized_xr, special_rates, policies=policies
     )
     tf_final = apply_currency_conversions(tf_with_rates)
 
     return tf_final
+
+
+def convert_to_target_currencies(
+    tf: pd.DataFrame, targets=("USD", "EUR", "JOD"), policy="nearest"
+):
+    """
+    Convert all transaction values into several target currencies in one pass.
+
+    Rates are resolved once into USD, then each target is derived from a
+    precomputed cross-rate array instead of re-running the USD conversion.
+    """
+    standardized_xr = load_standardized_exchange_rates()
+    tf_prepared = prepare_transaction_dates(tf)
+    special_rates = create_special_currency_rates()
+    policies = [] if policy == "nearest" else [policy]
+    tf_with_rates = find_exchange_rates_for_currency(
+        tf_prepared, standardized_xr, special_rates, policies=policies
+    )
+    if policy != "nearest":
+        tf_with_rates["exchange_rate"] = tf_with_rates[f"exchange_rate_{policy}"]
+    tf_final = apply_currency_conversions(tf_with_rates)
+
+    cross_rates = build_cross_rates(
+        tf_final["date"].values, targets, standardized_xr, special_rates, policy
+    )
+    return apply_target_currency_conversions(tf_final, cross_rates)
@@ -0,0 +1,137 @@
+"""
+Persistent memo for incremental USD conversion.
+
+The memo stores resolved (policy, currency, date) -> rate entries, so reruns
+over `transactions_cleaned.csv` only resolve currency-date pairs they have not
+seen. Entries are dropped whenever the Fed CSV or the special currency rates
+change.
+"""
+
+import hashlib
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from definitions import ROOT_DIR
+from lib.util_fed_h10 import file_fingerprint
+from lib.util_file import read_json, write_json
+from lib.util_xr import (
+    FED_XR_PATH,
+    apply_currency_conversions,
+    create_special_currency_rates,
+    find_exchange_rates_for_currency,
+    load_standardized_exchange_rates,
+    prepare_transaction_dates,
+)
+
+XR_MEMO_PATH = os.path.join(ROOT_DIR, "data", "xr", "rate_memo.json")
+
+
+def rate_source_fingerprint(fed_xr_path: str = FED_XR_PATH) -> str:
+    """Hash the Fed exchange rate file and the special currency rates."""
+    h = hashlib.sha256(file_fingerprint(fed_xr_path).encode())
+
+    special_rates = create_special_currency_rates()
+    for currency in sorted(special_rates):
+        rate_data = special_rates[currency]
+        h.update(currency.encode())
+        h.update(rate_data.index.values.astype("datetime64[ns]").tobytes())
+        h.update(rate_data["rate"].values.astype(float).tobytes())
+
+    return h.hexdigest()
+
+
+def _empty_memo(fingerprint: str) -> dict:
+    return {"source_fingerprint": fingerprint, "rates": {}}
+
+
+def load_rate_memo(fingerprint: str, memo_path: str = XR_MEMO_PATH) -> dict:
+    """Load the memo, discarding it if it was built from a different rate source."""
+    if not os.path.exists(memo_path):
+        return _empty_memo(fingerprint)
+
+    memo = read_json(memo_path)
+    if memo.get("source_fingerprint") != fingerprint:
+        print("Exchange rate source changed, invalidating rate memo")
+        return _empty_memo(fingerprint)
+
+    # Row hashes kept by earlier versions saved no lookups
+    memo.pop("rows", None)
+    return memo
+
+
+def save_rate_memo(memo: dict, memo_path: str = XR_MEMO_PATH) -> None:
+    memo["last_updated"] = datetime.now().isoformat()
+    write_json(memo, memo_path)
+
+
+def _pair_keys(tf_prepared: pd.DataFrame) -> pd.Series:
+    """Build "currency|date" keys; rows without a currency or date get None."""
+    dates = tf_prepared["date"].dt.strftime("%Y-%m-%dT%H:%M:%S")
+    keys = tf_prepared["currency"].astype(str) + "|" + dates
+    return keys.where(tf_prepared["currency"].notna() & dates.notna(), None)
+
+
+def _resolve_pairs(pair_keys, policies) -> dict:
+    """Resolve rates for unseen currency-date pairs in one vectorized call."""
+    standardized_xr = load_standardized_exchange_rates()
+    special_rates = create_special_currency_rates()
+
+    currencies, dates = zip(*(key.split("|", 1) for key in pair_keys))
+    pairs = pd.DataFrame({"currency": currencies, "date": pd.to_datetime(dates)})
+    resolved = find_exchange_rates_for_currency(
+        pairs, standardized_xr, special_rates, policies=policies
+    )
+
+    rates = {}
+    for policy in policies:
+        for key, rate in zip(pair_keys, resolved[f"exchange_rate_{policy}"]):
+            rates[f"{policy}|{key}"] = None if np.isnan(rate) else float(rate)
+    return rates
+
+
+def convert_all_to_usd_incremental(
+    tf: pd.DataFrame, policies=None, memo_path: str = XR_MEMO_PATH
+) -> pd.DataFrame:
+    """
+    Convert transaction values to USD, reusing rates memoized by earlier runs.
+
+    Produces the same columns as `convert_all_to_usd`, but only currency-date
+    pairs that are missing from the memo are looked up in the rate tables.
+    """
+    policies = policies or []
+    all_policies = ["nearest"] + [p for p in policies if p != "nearest"]
+
+    tf_prepared = prepare_transaction_dates(tf)
+    memo = load_rate_memo(rate_source_fingerprint(), memo_path)
+
+    pair_keys = _pair_keys(tf_prepared)
+    missing_pairs = sorted(
+        {
+            key
+            for key in pair_keys.dropna().unique()
+            if any(f"{policy}|{key}" not in memo["rates"] for policy in all_policies)
+        }
+    )
+    print(
+        f"{len(tf_prepared)} rows over {pair_keys.nunique()} currency-date pairs, "
+        f"resolving {len(missing_pairs)} new pairs"
+    )
+    if missing_pairs:
+        memo["rates"].update(_resolve_pairs(missing_pairs, all_policies))
+
+    rates = {
+        policy: pair_keys.map(lambda key: memo["rates"].get(f"{policy}|{key}"))
+        .astype(float)
+        .values
+        for policy in all_policies
+    }
+    tf_prepared["exchange_rate"] = rates["nearest"]
+    for policy in policies:
+        tf_prepared[f"exchange_rate_{policy}"] = rates[policy]
+
+    save_rate_memo(memo, memo_path)
+
+    return apply_currency_conversions(tf_prepared)